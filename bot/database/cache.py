@@ -0,0 +1,102 @@
+from typing import Callable, Dict, Iterable, Optional
+
+from cachetools import TTLCache
+
+# ================================================
+# Вычисляемые поля проекции и поля, от которых они зависят
+# ================================================
+DERIVED_FIELDS = {
+    "invited_count": ("invited_users",),
+    "current_agent": ("custom_agents", "current_agent_id"),
+}
+
+
+class CountingTTLCache(TTLCache):
+    """TTL + LRU кэш со счетчиками вытеснений и истечений"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        # Вызывается cachetools при вытеснении по размеру (LRU)
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired or [])
+        return expired
+
+
+class UserCache:
+    """Кэш документов пользователей в памяти процесса с write-through обновлениями"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # Значение: {"data": поля пользователя, "loaded": запрошенные поля, "full": загружен ли документ целиком}
+        # Проекция не возвращает отсутствующие в документе поля, поэтому запрошенные имена хранятся отдельно
+        self._entries = CountingTTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, fields: Optional[Iterable[str]]) -> Optional[Dict]:
+        """Возвращает копию данных пользователя, если в кэше есть все нужные поля"""
+        entry = self._entries.get(user_id)
+        if entry and (entry["full"] or (fields is not None and set(fields) <= entry["loaded"])):
+            self.hits += 1
+            return dict(entry["data"])
+        self.misses += 1
+        return None
+
+    def store(
+        self, user_id: int, data: Dict, full: bool = False, fields: Optional[Iterable[str]] = None
+    ) -> None:
+        """Сохраняет загруженные поля, объединяя их с уже закэшированными"""
+        loaded = set(data) | set(fields or ())
+        entry = self._entries.get(user_id)
+        if entry:
+            entry["data"].update(data)
+            entry["loaded"] |= loaded
+            entry["full"] = entry["full"] or full
+            return
+        self._entries[user_id] = {"data": dict(data), "loaded": loaded, "full": full}
+
+    def update(self, user_id: int, changes: Dict) -> None:
+        """Записывает изменения полей в кэш (write-through)"""
+        self.modify(user_id, lambda data: data.update(changes))
+
+    def modify(self, user_id: int, func: Callable[[Dict], None]) -> None:
+        """Применяет функцию к закэшированным данным и сбрасывает устаревшие вычисляемые поля"""
+        entry = self._entries.get(user_id)
+        if not entry:
+            return
+        data = entry["data"]
+        before = {name: data.get(name) for deps in DERIVED_FIELDS.values() for name in deps}
+        func(data)
+        entry["loaded"] |= data.keys()
+        for derived, deps in DERIVED_FIELDS.items():
+            if any(data.get(name) is not before[name] for name in deps):
+                data.pop(derived, None)
+                entry["loaded"].discard(derived)
+
+    def invalidate(self, user_id: int) -> None:
+        """Удаляет пользователя из кэша после записи в обход update/modify (миграции)"""
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики для подбора размера кэша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": int(self._entries.maxsize),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio_pct": round(self.hits * 100 / total) if total else 0,
+            "evictions": self._entries.evictions,
+            "expirations": self._entries.expirations,
+        }
@@ -1,11 +1,18 @@
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from bot.database.cache import UserCache
 from bot.database.models import User, Agent
+from bot.services.context_builder import count_tokens
+from bot.utils.daily_tokens import build_daily_rewards_query, build_lazy_reserve, is_reward_due
 from bot.utils.logger import setup_logger
-from config import GPT_MODEL
+from config import (
+    GPT_MODEL, USER_CACHE_SIZE, USER_CACHE_TTL, LAZY_DAILY_TOKENS, DAILY_TOKENS
+)
 
 # ================================================
 # Логгер для базы данных
@@ -29,53 +36,254 @@ def handle_db_errors(operation_name: str):
     return decorator
 
 
+# ================================================
+# Проекции документа пользователя
+# ================================================
+# Поля, которые загружаются всегда (нужны почти каждому обработчику)
+USER_BASE_FIELDS = (
+    "user_id", "username", "language_code", "balance", "current_model", "current_agent_id",
+    "last_daily_reward",
+)
+
+# Дополнительные поля, которые обработчик может запросить явно
+USER_OPTIONAL_FIELDS = {
+    "created_at": 1,
+    "last_daily_reward": 1,
+    "invited_users": 1,
+    "invited_count": {"$size": {"$ifNull": ["$invited_users", []]}},
+    "custom_agents": 1,
+    # Только активный агент вместо всего списка
+    "current_agent": {
+        "$filter": {
+            "input": {"$ifNull": ["$custom_agents", []]},
+            "cond": {"$eq": ["$$this.agent_id", "$current_agent_id"]},
+        }
+    },
+}
+
+
+def build_user_projection(fields: Optional[Iterable[str]]) -> Optional[Dict]:
+    # None - загрузить документ целиком, иначе базовые поля + запрошенные
+    if fields is None:
+        return None
+    projection = {"_id": 0, **{name: 1 for name in USER_BASE_FIELDS}}
+    for name in fields:
+        if name not in USER_OPTIONAL_FIELDS:
+            raise ValueError(f"Неизвестное поле пользователя: {name}")
+        projection[name] = USER_OPTIONAL_FIELDS[name]
+    return projection
+
+
+def collect_plan_stages(plan: Any) -> Set[str]:
+    # Рекурсивно собирает названия стадий из вывода explain()
+    stages = set()
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= collect_plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= collect_plan_stages(item)
+    return stages
+
+
+def build_history_query(
+    user_id: int, agent_id: Optional[str],
+    before: Optional[datetime] = None, after: Optional[datetime] = None
+) -> Dict:
+    # Фильтр истории по режиму и временному окну
+    query = {"user_id": user_id, "agent_id": agent_id}
+    timestamp = {}
+    if before is not None:
+        timestamp["$lt"] = before
+    if after is not None:
+        timestamp["$gt"] = after
+    if timestamp:
+        query["timestamp"] = timestamp
+    return query
+
+
+def replace_cached_agents(data: Dict, func) -> None:
+    # Обновляет список агентов в кэше, только если он был загружен
+    if "custom_agents" in data:
+        data["custom_agents"] = func(data["custom_agents"] or [])
+
+
 class UserManager:
     def __init__(self, db: "Database"):
         self.db = db
+        self.cache = UserCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
     @handle_db_errors("получения пользователя")
     async def get_user(
-        self, user_id: int, username: Optional[str], language_code: str = "en"
+        self, user_id: int, username: Optional[str], language_code: str = "en",
+        fields: Optional[Iterable[str]] = None
     ) -> User:
         """Получает пользователя из базы данных или создает нового."""
-        user = await self.db.users.find_one({"user_id": user_id})
-        if not user:
-            await self.db.add_user(user_id, username, language_code)
-            user = await self.db.users.find_one({"user_id": user_id})
-        return User.from_dict(user)
-
-    @handle_db_errors("обновления баланса и истории")
-    async def update_balance_and_history(
-        self, user_id: int, tokens_cost: int, model: str,
-        message_text: str, response: str, agent_id: Optional[str] = None
+        requested = None if fields is None else (*USER_BASE_FIELDS, *fields)
+        cached = self.cache.get(user_id, requested)
+        if cached is not None:
+            return User.from_dict(self._with_pending_refill(cached))
+        
+        # Один атомарный запрос: вернуть существующего или вставить нового пользователя
+        projection = build_user_projection(fields)
+        if projection is not None:
+            # created_at нужен, чтобы отличить вставку от существующего документа
+            projection = {**projection, "created_at": 1}
+        new_user_data = self.db.build_new_user_data(user_id, username, language_code)
+        try:
+            user = await self.db.users.find_one_and_update(
+                {"user_id": user_id},
+                {"$setOnInsert": new_user_data},
+                projection=projection,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            if user.get("created_at") == new_user_data["created_at"]:
+                logger.info(f"Добавлен новый пользователь: {user_id}")
+        except DuplicateKeyError:
+            # Параллельный запрос уже вставил пользователя - просто читаем его
+            user = await self.db.users.find_one({"user_id": user_id}, projection)
+        user.pop("_id", None)
+        if fields is not None and "created_at" not in fields:
+            user.pop("created_at", None)
+        self.cache.store(user_id, user, full=fields is None, fields=requested)
+        return User.from_dict(self._with_pending_refill(user))
+
+    @staticmethod
+    def _with_pending_refill(data: Dict) -> Dict:
+        # В ленивом режиме показываем баланс с учетом еще не записанного начисления
+        if LAZY_DAILY_TOKENS and is_reward_due(data, datetime.now()):
+            return {**data, "balance": DAILY_TOKENS}
+        return data
+
+    @handle_db_errors("загрузки полей пользователя")
+    async def load_fields(self, user: User, *fields: str) -> User:
+        """Дозагружает поля пользователя, которые не были запрошены изначально."""
+        missing = [name for name in fields if name not in user.loaded_fields]
+        if missing:
+            data = await self.db.users.find_one(
+                {"user_id": user.user_id}, build_user_projection(missing)
+            )
+            if data:
+                self.cache.store(user.user_id, data, fields=missing)
+                user.update_from_dict(data)
+                # Поля, которых нет в документе, тоже считаются загруженными
+                user.loaded_fields = user.loaded_fields | frozenset(missing)
+        return user
+
+    @handle_db_errors("резервирования токенов")
+    async def reserve_tokens(self, user_id: int, tokens_cost: int) -> bool:
+        """Атомарно списывает токены, если баланса хватает. Возвращает успех резерва."""
+        if LAZY_DAILY_TOKENS:
+            # Ежедневное начисление применяется в той же атомарной операции
+            condition, update = build_lazy_reserve(datetime.now(), tokens_cost)
+            query = {"user_id": user_id, **condition}
+        else:
+            query = {"user_id": user_id, "balance": {"$gte": tokens_cost}}
+            update = {"$inc": {"balance": -tokens_cost}}
+        
+        user = await self.db.users.find_one_and_update(
+            query,
+            update,
+            projection={"_id": 0, "balance": 1, "last_daily_reward": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is None:
+            return False
+        self.cache.update(user_id, user)
+        return True
+
+    @handle_db_errors("возврата токенов")
+    async def refund_tokens(self, user_id: int, tokens_cost: int) -> None:
+        """Возвращает ранее зарезервированные токены."""
+        user = await self.db.users.find_one_and_update(
+            {"user_id": user_id},
+            {"$inc": {"balance": tokens_cost}},
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is not None:
+            self.cache.update(user_id, {"balance": user["balance"]})
+
+    @handle_db_errors("сохранения истории")
+    async def save_history(
+        self, user_id: int, model: str, message_text: str, response: str,
+        agent_id: Optional[str] = None
     ) -> None:
-        """Обновляет баланс и историю сообщений пользователя."""
-        message_entry = {
+        """Сохраняет ход диалога после успешного ответа (баланс уже списан резервом)."""
+        await self.db.history.insert_one({
+            "user_id": user_id,
+            "agent_id": agent_id,  # None - режим по умолчанию
             "model": model,
             "message": message_text,
             "response": response,
+            # Размер хода сохраняется один раз, чтобы не пересчитывать его при каждом запросе
+            "tokens": count_tokens(message_text) + count_tokens(response),
             "timestamp": datetime.utcnow(),
-        }
-        
-        if agent_id:
-            # Update agent-specific history
-            update_data = {
-                "$inc": {"balance": -tokens_cost},
-                "$push": {f"agent_histories.{agent_id}": message_entry}
-            }
-        else:
-            # Update default history
-            update_data = {
-                "$inc": {"balance": -tokens_cost},
-                "$push": {"messages_history": message_entry}
-            }
+        })
+
+    @handle_db_errors("получения истории")
+    async def get_history(
+        self, user_id: int, agent_id: Optional[str], limit: int,
+        before: Optional[datetime] = None, after: Optional[datetime] = None,
+        oldest_first: bool = False
+    ) -> List[Dict]:
+        """Возвращает limit последних (или самых ранних) записей истории в хронологическом порядке."""
+        query = build_history_query(user_id, agent_id, before, after)
         
-        await self.db.users.update_one({"user_id": user_id}, update_data)
+        # Читаем по индексу с нужного конца и возвращаем в хронологическом порядке
+        cursor = (
+            self.db.history.find(query, {"_id": 0, "user_id": 0, "agent_id": 0})
+            .sort("timestamp", ASCENDING if oldest_first else DESCENDING)
+            .limit(limit)
+        )
+        entries = await cursor.to_list(length=limit)
+        if not oldest_first:
+            entries.reverse()
+        return entries
+
+    @handle_db_errors("подсчета истории")
+    async def count_history(
+        self, user_id: int, agent_id: Optional[str], after: Optional[datetime] = None
+    ) -> int:
+        """Возвращает количество записей истории для агента или дефолтного режима."""
+        return await self.db.history.count_documents(
+            build_history_query(user_id, agent_id, after=after)
+        )
+
+    # ================================================
+    # Сводки длинных диалогов
+    # ================================================
+    @handle_db_errors("получения сводки диалога")
+    async def get_summary(self, user_id: int, agent_id: Optional[str]) -> Optional[Dict]:
+        """Возвращает сводку ранних ходов диалога, если она есть."""
+        return await self.db.summaries.find_one(
+            {"user_id": user_id, "agent_id": agent_id},
+            {"_id": 0, "summary": 1, "summarized_until": 1},
+        )
+
+    @handle_db_errors("сохранения сводки диалога")
+    async def save_summary(
+        self, user_id: int, agent_id: Optional[str], summary: str, summarized_until: datetime
+    ) -> None:
+        """Сохраняет сводку диалога до указанного момента включительно."""
+        await self.db.summaries.update_one(
+            {"user_id": user_id, "agent_id": agent_id},
+            {"$set": {
+                "summary": summary,
+                "summarized_until": summarized_until,
+                "updated_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
 
     @handle_db_errors("обновления данных пользователя")
     async def update_user(self, user_id: int, update_data: Dict) -> None:
         """Обновляет данные пользователя."""
         await self.db.users.update_one({"user_id": user_id}, {"$set": update_data})
+        self.cache.update(user_id, update_data)
 
     @handle_db_errors("добавления приглашенного пользователя")
     async def add_invited_user(self, inviter_id: int, invited_id: int) -> None:
@@ -84,6 +292,13 @@ class UserManager:
             {"user_id": inviter_id},
             {"$push": {"invited_users": invited_id}},
         )
+        
+        def add_invited(data: Dict) -> None:
+            if "invited_users" in data:
+                data["invited_users"] = [*data["invited_users"], invited_id]
+            if "invited_count" in data:
+                data["invited_count"] += 1
+        self.cache.modify(inviter_id, add_invited)
 
     # ================================================
     # Agent Management Methods
@@ -95,14 +310,23 @@ class UserManager:
             {"user_id": user_id},
             {"$push": {"custom_agents": agent.to_dict()}}
         )
+        self.cache.modify(user_id, lambda data: replace_cached_agents(
+            data, lambda agents: [*agents, agent.to_dict()]
+        ))
 
     @handle_db_errors("обновления агента")
     async def update_agent(self, user_id: int, agent_id: str, update_data: Dict) -> None:
         """Обновляет данные агента."""
+        agent_data = {**update_data, "agent_id": agent_id}
         await self.db.users.update_one(
             {"user_id": user_id, "custom_agents.agent_id": agent_id},
-            {"$set": {f"custom_agents.$.": {**update_data, "agent_id": agent_id}}}
+            {"$set": {"custom_agents.$": agent_data}}
         )
+        self.cache.modify(user_id, lambda data: replace_cached_agents(
+            data, lambda agents: [
+                agent_data if agent.get("agent_id") == agent_id else agent for agent in agents
+            ]
+        ))
 
     @handle_db_errors("удаления агента")
     async def delete_agent(self, user_id: int, agent_id: str) -> None:
@@ -114,18 +338,22 @@ class UserManager:
         )
         
         # Remove agent's message history
+        await self.db.history.delete_many({"user_id": user_id, "agent_id": agent_id})
+        await self.db.summaries.delete_one({"user_id": user_id, "agent_id": agent_id})
+        
+        # If this was the current agent, reset current_agent_id
         await self.db.users.update_one(
-            {"user_id": user_id},
-            {"$unset": {f"agent_histories.{agent_id}": ""}}
+            {"user_id": user_id, "current_agent_id": agent_id},
+            {"$unset": {"current_agent_id": ""}}
         )
         
-        # If this was the current agent, reset current_agent_id
-        user_data = await self.db.users.find_one({"user_id": user_id})
-        if user_data and user_data.get("current_agent_id") == agent_id:
-            await self.db.users.update_one(
-                {"user_id": user_id},
-                {"$unset": {"current_agent_id": ""}}
-            )
+        def remove_agent(data: Dict) -> None:
+            replace_cached_agents(data, lambda agents: [
+                agent for agent in agents if agent.get("agent_id") != agent_id
+            ])
+            if data.get("current_agent_id") == agent_id:
+                data["current_agent_id"] = None
+        self.cache.modify(user_id, remove_agent)
 
     @handle_db_errors("установки текущего агента")
     async def set_current_agent(self, user_id: int, agent_id: Optional[str]) -> None:
@@ -136,46 +364,18 @@ class UserManager:
                 {"$unset": {"current_agent_id": ""}}
             )
         else:
-            # Initialize agent history if it doesn't exist
             await self.db.users.update_one(
                 {"user_id": user_id},
-                {
-                    "$set": {"current_agent_id": agent_id},
-                    "$setOnInsert": {f"agent_histories.{agent_id}": []}
-                },
-                upsert=False
+                {"$set": {"current_agent_id": agent_id}}
             )
-            
-            # Ensure agent_histories field exists
-            await self.db.users.update_one(
-                {"user_id": user_id, "agent_histories": {"$exists": False}},
-                {"$set": {"agent_histories": {}}}
-            )
-            
-            # Initialize specific agent history if not exists
-            user_data = await self.db.users.find_one({"user_id": user_id})
-            if user_data and "agent_histories" in user_data:
-                if agent_id not in user_data["agent_histories"]:
-                    await self.db.users.update_one(
-                        {"user_id": user_id},
-                        {"$set": {f"agent_histories.{agent_id}": []}}
-                    )
+        self.cache.update(user_id, {"current_agent_id": agent_id})
     
     @handle_db_errors("очистки истории")
     async def clear_history(self, user_id: int, agent_id: Optional[str] = None) -> None:
         """Очищает историю сообщений для агента или дефолтного режима."""
-        if agent_id:
-            # Clear specific agent history
-            await self.db.users.update_one(
-                {"user_id": user_id},
-                {"$set": {f"agent_histories.{agent_id}": []}}
-            )
-        else:
-            # Clear default history
-            await self.db.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"messages_history": []}}
-            )
+        # История хранится вне документа пользователя, поэтому кэш не затрагивается
+        await self.db.history.delete_many({"user_id": user_id, "agent_id": agent_id})
+        await self.db.summaries.delete_one({"user_id": user_id, "agent_id": agent_id})
 
 
 class Database:
@@ -185,13 +385,11 @@ class Database:
     DEFAULT_USER_DATA = {
         "balance": 0,
         "current_model": GPT_MODEL,
-        "created_at": None,  # Будет установлено в add_user
-        "messages_history": [],  # Default mode history
+        "created_at": None,  # Будет установлено в build_new_user_data
         "invited_users": [],
         "last_daily_reward": None,
         "current_agent_id": None,
         "custom_agents": [],
-        "agent_histories": {},  # Agent-specific histories
     }
 
     def __init__(self, url: str):
@@ -209,28 +407,86 @@ class Database:
         )
         self.db = self.client.ai_bot
         self.users = self.db.users
+        self.history = self.db.history  # История диалогов отдельно от документа пользователя
+        self.summaries = self.db.summaries  # Сводки ранних ходов длинных диалогов
+        self.response_cache = self.db.response_cache  # Кэш ответов нейросети (backend "mongo")
         self.user_manager = UserManager(self)
 
-    @handle_db_errors("добавления пользователя")
-    async def add_user(
+    def build_new_user_data(
         self, user_id: int, username: Optional[str], language_code: str
-    ) -> None:
-        """Добавляет нового пользователя в базу данных."""
+    ) -> Dict:
+        """Формирует документ нового пользователя (без user_id - он берется из фильтра)."""
         if not isinstance(user_id, int) or user_id <= 0:
             raise ValueError("Некорректный user_id")
         
-        if await self.users.find_one({"user_id": user_id}):
-            return  # Пользователь уже существует
-        
-        user_data = {
+        now = datetime.utcnow()
+        return {
             **self.DEFAULT_USER_DATA,
-            "user_id": user_id,
             "username": username,
             "language_code": language_code,
-            "created_at": datetime.utcnow(),
+            # BSON хранит время с точностью до миллисекунд - по совпадению created_at get_user узнает вставку
+            "created_at": now.replace(microsecond=now.microsecond // 1000 * 1000),
         }
-        await self.users.insert_one(user_data)
-        logger.info(f"Добавлен новый пользователь: {user_id}")
+
+    @handle_db_errors("создания индексов")
+    async def create_indexes(self) -> None:
+        """Создает индексы коллекций (операция идемпотентна)."""
+        # Уникальность user_id защищает get-or-create от дублей при гонке
+        try:
+            await self.users.create_index("user_id", unique=True, name="user_id_unique")
+        except DuplicateKeyError as e:
+            # Старые версии могли создать дубли пользователей - их нужно удалить до построения индекса
+            raise RuntimeError(
+                "В коллекции users есть дубли user_id, уникальный индекс не построен. "
+                "Удалите их командой: python -m bot.database.migrations"
+            ) from e
+        # Диапазонный запрос ежедневного начисления токенов
+        await self.users.create_index("last_daily_reward", name="last_daily_reward")
+        await self.history.create_index(
+            [("user_id", ASCENDING), ("agent_id", ASCENDING), ("timestamp", DESCENDING)],
+            name="user_agent_timestamp",
+        )
+        await self.summaries.create_index(
+            [("user_id", ASCENDING), ("agent_id", ASCENDING)],
+            unique=True, name="user_agent_unique",
+        )
+        # Срок жизни хранится в документе, поэтому смена RESPONSE_CACHE_TTL не требует пересоздания индекса
+        await self.response_cache.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+        await self.response_cache.create_index("created_at", name="created_at")
+        logger.info("Индексы базы данных проверены")
+
+    def get_query_shapes(self) -> List[Tuple[str, Any, Dict, Optional[List]]]:
+        """Формы запросов UserManager и планировщика: (название, коллекция, фильтр, сортировка)."""
+        sample_agent_id = "00000000-0000-0000-0000-000000000000"
+        return [
+            ("users.user_id", self.users, {"user_id": 1}, None),
+            ("users.update_agent", self.users,
+             {"user_id": 1, "custom_agents.agent_id": sample_agent_id}, None),
+            ("users.reset_current_agent", self.users,
+             {"user_id": 1, "current_agent_id": sample_agent_id}, None),
+            ("users.daily_rewards", self.users, build_daily_rewards_query(datetime.now()), None),
+            ("history.get_history", self.history, {"user_id": 1, "agent_id": None},
+             [("timestamp", DESCENDING)]),
+            ("history.by_agent", self.history, {"user_id": 1, "agent_id": sample_agent_id}, None),
+            ("summaries.by_agent", self.summaries, {"user_id": 1, "agent_id": None}, None),
+        ]
+
+    async def verify_query_plans(self) -> None:
+        """Проверяет через explain(), что ни один запрос не выполняется сканированием коллекции."""
+        failed = []
+        for name, collection, query, sort in self.get_query_shapes():
+            cursor = collection.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = await cursor.explain()
+            stages = sorted(collect_plan_stages(plan.get("queryPlanner", {})))
+            logger.info(f"План запроса {name}: {', '.join(stages)}")
+            if "COLLSCAN" in stages:
+                failed.append(name)
+        
+        if failed:
+            raise RuntimeError(f"Запросы выполняются без индекса (COLLSCAN): {', '.join(failed)}")
+        logger.info("Все запросы используют индексы")
 
     async def get_user_manager(self) -> UserManager:
         """Возвращает экземпляр UserManager."""
@@ -0,0 +1,143 @@
+import asyncio
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+from bot.database.database import Database, handle_db_errors
+from bot.utils.logger import setup_logger
+from config import MONGO_URL, HISTORY_MIGRATION_BATCH_SIZE
+
+# ================================================
+# Логгер для миграций
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Поля со встроенной историей в документе пользователя
+# ================================================
+LEGACY_HISTORY_QUERY = {
+    "$or": [
+        {"messages_history": {"$exists": True}},
+        {"agent_histories": {"$exists": True}},
+    ]
+}
+LEGACY_HISTORY_FIELDS = {"messages_history": "", "agent_histories": ""}
+
+
+def build_history_operations(user: Dict) -> List[UpdateOne]:
+    # Превращает встроенные массивы пользователя в upsert-операции для коллекции history
+    # Upsert по ключу (user_id, agent_id, timestamp, legacy_index) делает повторный запуск безопасным
+    # Позиция в массиве различает записи без timestamp или с одинаковым timestamp
+    histories = {None: user.get("messages_history") or []}
+    for agent_id, entries in (user.get("agent_histories") or {}).items():
+        histories[agent_id] = entries or []
+
+    operations = []
+    for agent_id, entries in histories.items():
+        for index, entry in enumerate(entries):
+            key = {
+                "user_id": user["user_id"],
+                "agent_id": agent_id,
+                "timestamp": entry.get("timestamp"),
+                "legacy_index": index,
+            }
+            operations.append(
+                UpdateOne(key, {"$setOnInsert": {**key, **entry}}, upsert=True)
+            )
+    return operations
+
+
+@handle_db_errors("удаления дублей пользователей")
+async def deduplicate_users(db: Database) -> int:
+    """Оставляет по одному документу на user_id (самый ранний), перенося в него приглашенных."""
+    # Дубли оставила старая проверка-затем-вставка при параллельных первых сообщениях
+    duplicates = db.users.aggregate([
+        {"$group": {
+            "_id": "$user_id",
+            "ids": {"$push": "$_id"},
+            "invited_users": {"$push": {"$ifNull": ["$invited_users", []]}},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+
+    removed = 0
+    async for group in duplicates:
+        keep, *extra = sorted(group["ids"])
+        invited = sorted({invited for items in group["invited_users"] for invited in items})
+        if invited:
+            await db.users.update_one({"_id": keep}, {"$addToSet": {"invited_users": {"$each": invited}}})
+        removed += (await db.users.delete_many({"_id": {"$in": extra}})).deleted_count
+        # Документ изменен в обход UserManager - закэшированная копия устарела
+        db.user_manager.cache.invalidate(group["_id"])
+        logger.warning(f"Удалено {len(extra)} дублей пользователя {group['_id']}")
+
+    logger.info(f"Удаление дублей пользователей завершено: удалено {removed} документов")
+    return removed
+
+
+async def ensure_unique_user_ids(db: Database) -> None:
+    """Перед первым построением уникального индекса user_id удаляет дубли."""
+    # Когда индекс уже есть, дублей быть не может - полный проход по коллекции не нужен
+    if "user_id_unique" not in await db.users.index_information():
+        await deduplicate_users(db)
+
+
+@handle_db_errors("миграции истории")
+async def migrate_embedded_histories(
+    db: Database, batch_size: int = HISTORY_MIGRATION_BATCH_SIZE
+) -> int:
+    """Переносит встроенную историю пользователей в коллекцию history пачками."""
+    await ensure_unique_user_ids(db)
+    await db.create_indexes()
+
+    cursor = db.users.find(
+        LEGACY_HISTORY_QUERY,
+        {"user_id": 1, "messages_history": 1, "agent_histories": 1},
+        batch_size=batch_size,
+    )
+
+    migrated_users = 0
+    operations: List[UpdateOne] = []
+    user_ids: List[int] = []
+
+    async def flush() -> None:
+        # Сначала записываем историю, затем удаляем встроенные массивы
+        if operations:
+            await db.history.bulk_write(operations, ordered=False)
+        await db.users.update_many(
+            {"user_id": {"$in": user_ids}}, {"$unset": LEGACY_HISTORY_FIELDS}
+        )
+        for user_id in user_ids:
+            db.user_manager.cache.invalidate(user_id)
+        logger.info(
+            f"Миграция истории: пачка из {len(user_ids)} пользователей, {len(operations)} записей"
+        )
+        operations.clear()
+        user_ids.clear()
+
+    async for user in cursor:
+        operations.extend(build_history_operations(user))
+        user_ids.append(user["user_id"])
+        migrated_users += 1
+
+        if len(user_ids) >= batch_size or len(operations) >= batch_size:
+            await flush()
+
+    if user_ids:
+        await flush()
+
+    logger.info(f"Миграция истории завершена: обработано {migrated_users} пользователей")
+    return migrated_users
+
+
+async def main() -> None:
+    db = Database(MONGO_URL)
+    try:
+        await migrate_embedded_histories(db)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
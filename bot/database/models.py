@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, List, Optional
 import uuid
 
 
@@ -44,47 +44,54 @@ class User:
     language_code: str
     balance: int
     current_model: str
-    invited_users: List[int]
-    messages_history: List[Dict]  # Default mode history
-    created_at: datetime
-    last_daily_reward: Optional[datetime]
+    # Редко используемые поля загружаются только по запросу (None - не загружено)
+    invited_users: Optional[List[int]] = None
+    invited_count: Optional[int] = None
+    created_at: Optional[datetime] = None
+    last_daily_reward: Optional[datetime] = None
     # New agent-related fields
     current_agent_id: Optional[str] = None
-    custom_agents: List[Dict] = None
-    # Agent-specific message histories
-    agent_histories: Dict[str, List[Dict]] = None
+    custom_agents: Optional[List[Dict]] = None
+    # Только активный агент (результат $filter-проекции по current_agent_id)
+    current_agent: Optional[List[Dict]] = None
+    loaded_fields: FrozenSet[str] = field(default_factory=frozenset, repr=False)
+
+    @staticmethod
+    def _parse_fields(data: Dict) -> Dict:
+        # Оставляет только известные поля модели, пришедшие из проекции
+        known = {f.name for f in fields(User)} - {"loaded_fields"}
+        parsed = {key: value for key, value in data.items() if key in known}
+        if "custom_agents" in parsed and parsed["custom_agents"] is None:
+            parsed["custom_agents"] = []
+        return parsed
 
     @classmethod
     def from_dict(cls, data: Dict) -> "User":
-        custom_agents = data.get("custom_agents", [])
-        if custom_agents is None:
-            custom_agents = []
-        
-        agent_histories = data.get("agent_histories", {})
-        if agent_histories is None:
-            agent_histories = {}
-        
+        parsed = cls._parse_fields(data)
         return cls(
-            user_id=data["user_id"],
-            username=data["username"],
-            language_code=data["language_code"],
-            balance=data["balance"],
-            current_model=data["current_model"],
-            invited_users=data["invited_users"],
-            messages_history=data["messages_history"],
-            created_at=data["created_at"],
-            last_daily_reward=data["last_daily_reward"],
-            current_agent_id=data.get("current_agent_id"),
-            custom_agents=custom_agents,
-            agent_histories=agent_histories,
+            user_id=parsed.pop("user_id"),
+            username=parsed.pop("username", None),
+            language_code=parsed.pop("language_code", "en"),
+            balance=parsed.pop("balance", 0),
+            current_model=parsed.pop("current_model", ""),
+            loaded_fields=frozenset(cls._parse_fields(data)),
+            **parsed,
         )
 
+    def update_from_dict(self, data: Dict) -> None:
+        """Дозагружает поля в уже созданный объект"""
+        parsed = self._parse_fields(data)
+        for name, value in parsed.items():
+            setattr(self, name, value)
+        self.loaded_fields = self.loaded_fields | frozenset(parsed)
+
     def get_current_agent(self) -> Optional[Agent]:
         """Get currently active agent"""
-        if not self.current_agent_id or not self.custom_agents:
+        if not self.current_agent_id:
             return None
         
-        for agent_data in self.custom_agents:
+        agents = self.custom_agents if "custom_agents" in self.loaded_fields else self.current_agent
+        for agent_data in agents or []:
             if agent_data.get("agent_id") == self.current_agent_id:
                 return Agent.from_dict(agent_data)
         return None
@@ -94,15 +101,9 @@ class User:
         if not self.custom_agents:
             return []
         return [Agent.from_dict(agent_data) for agent_data in self.custom_agents]
-    
-    def get_current_history(self) -> List[Dict]:
-        """Get message history for current context (agent or default)"""
-        if self.current_agent_id and self.agent_histories:
-            return self.agent_histories.get(self.current_agent_id, [])
-        return self.messages_history
-    
-    def get_agent_history(self, agent_id: str) -> List[Dict]:
-        """Get message history for specific agent"""
-        if not self.agent_histories:
-            return []
-        return self.agent_histories.get(agent_id, [])
+
+    def get_invited_count(self) -> int:
+        """Количество приглашенных пользователей"""
+        if self.invited_count is not None:
+            return self.invited_count
+        return len(self.invited_users or [])
@@ -28,7 +28,7 @@ router = Router()
 # Команды управления агентами
 # ================================================
 @router.message(Command("agents"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agents_command(message: types.Message, db: Database, user: User):
     """Показать меню управления агентами"""
     agents = user.get_agents_list()
@@ -55,7 +55,7 @@ async def agents_command(message: types.Message, db: Database, user: User):
         )
 
 @router.message(Command("cancel"))
-@get_user_decorator
+@get_user_decorator(fields=())
 async def cancel_conversation(message: types.Message, db: Database, user: User):
     """Отменить текущую операцию"""
     if user.user_id in USER_STATES:
@@ -69,7 +69,7 @@ async def cancel_conversation(message: types.Message, db: Database, user: User):
 # Callback обработчики для агентов
 # ================================================
 @router.callback_query(F.data == "agents_menu")
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agents_menu_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Показать главное меню агентов"""
     agents = user.get_agents_list()
@@ -100,7 +100,7 @@ async def agents_menu_callback(callback: types.CallbackQuery, db: Database, user
     await callback.answer()
 
 @router.callback_query(F.data == "agents_list")
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agents_list_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Показать список агентов"""
     agents = user.get_agents_list()
@@ -134,7 +134,7 @@ async def agents_list_callback(callback: types.CallbackQuery, db: Database, user
     await callback.answer()
 
 @router.callback_query(F.data == "agents_manage")
-@get_user_decorator  
+@get_user_decorator(fields=("custom_agents",))
 async def agents_manage_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Показать меню управления агентами"""
     agents = user.get_agents_list()
@@ -154,7 +154,7 @@ async def agents_manage_callback(callback: types.CallbackQuery, db: Database, us
     await callback.answer()
 
 @router.callback_query(F.data.startswith("agent_switch_"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_switch_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Переключиться на агента или стандартный режим"""
     action = callback.data.replace("agent_switch_", "")
@@ -186,7 +186,7 @@ async def agent_switch_callback(callback: types.CallbackQuery, db: Database, use
     await callback.answer()
 
 @router.callback_query(F.data.startswith("agent_edit_"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_edit_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Показать меню редактирования агента"""
     agent_id = callback.data.replace("agent_edit_", "")
@@ -208,7 +208,7 @@ async def agent_edit_callback(callback: types.CallbackQuery, db: Database, user:
     await callback.answer()
 
 @router.callback_query(F.data.startswith("agent_delete_"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_delete_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Подтверждение удаления агента"""
     if callback.data.startswith("agent_delete_confirm_"):
@@ -253,7 +253,7 @@ async def agent_delete_callback(callback: types.CallbackQuery, db: Database, use
         await callback.answer()
 
 @router.callback_query(F.data == "agent_create")
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_create_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Начать создание нового агента"""
     agents = user.get_agents_list()
@@ -278,7 +278,7 @@ async def agent_create_callback(callback: types.CallbackQuery, db: Database, use
     await callback.answer()
 
 @router.callback_query(F.data.startswith("agent_edit_name_"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_edit_name_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Начать редактирование имени агента"""
     agent_id = callback.data.replace("agent_edit_name_", "")
@@ -302,7 +302,7 @@ async def agent_edit_name_callback(callback: types.CallbackQuery, db: Database,
     await callback.answer()
 
 @router.callback_query(F.data.startswith("agent_edit_prompt_"))
-@get_user_decorator
+@get_user_decorator(fields=("custom_agents",))
 async def agent_edit_prompt_callback(callback: types.CallbackQuery, db: Database, user: User):
     """Начать редактирование промпта агента"""
     agent_id = callback.data.replace("agent_edit_prompt_", "")
@@ -336,6 +336,8 @@ async def handle_agent_creation_conversation(message: types.Message, db: Databas
         return False
     
     manager = await db.get_user_manager()
+    # Список агентов нужен только в режиме диалога - загружаем лениво
+    await manager.load_fields(user, "custom_agents")
     
     # Handle agent name input (creation)
     if user_state == STATE_CREATING_AGENT_NAME:
@@ -1,14 +1,19 @@
-import re
+import time
 from functools import wraps
-from typing import Optional, Union, Callable, Any
+from typing import Optional, Union, Callable, Any, Iterable, AsyncIterator, List
 
 from aiogram import Router, types
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 
 from bot.database.database import Database
 from bot.database.models import User
+from bot.utils.formatting import (
+    TELEGRAM_MESSAGE_LIMIT, format_to_html, html_to_text, split_html, validate_telegram_html
+)
 from bot.utils.localization import get_text
 from bot.utils.logger import setup_logger
+from config import STREAM_EDIT_INTERVAL
 
 # ================================================
 # Логгер для обработчиков
@@ -26,6 +31,7 @@ STATE_EDITING_AGENT_PROMPT = "editing_agent_prompt"
 MAX_AGENTS_PER_USER = 10
 MAX_AGENT_NAME_LENGTH = 50
 MAX_AGENT_PROMPT_LENGTH = 2000
+STREAM_CURSOR = " ▌"
 
 # ================================================
 # Глобальные переменные состояния
@@ -34,61 +40,31 @@ USER_STATES = {}  # Простая система состояний для ра
 AGENT_CREATION_DATA = {}  # Временные данные создания агента
 MODEL_SERVICES = {}  # Кэш сервисов моделей
 
-# ================================================
-# Утилитные функции для форматирования
-# ================================================
-def format_to_html(text: str) -> str:
-    # Универсальная функция форматирования markdown в HTML
-    
-    # Экранируем HTML теги, кроме разрешенных Telegram
-    import html
-    
-    # Сначала проверяем есть ли блоки кода (они должны остаться как есть)
-    code_blocks = []
-    def preserve_code_blocks(match):
-        code_blocks.append(match.group(0))
-        return f"__CODE_BLOCK_{len(code_blocks)-1}__"
-    
-    # Сохраняем блоки кода (включая SVG, XML, JSON и т.д.)
-    text = re.sub(r'```[\s\S]*?```', preserve_code_blocks, text)
-    text = re.sub(r'`[^`]+`', preserve_code_blocks, text)
-    text = re.sub(r'<svg[\s\S]*?</svg>', preserve_code_blocks, text, flags=re.IGNORECASE)
-    
-    # Экранируем остальные HTML теги
-    text = html.escape(text)
-    
-    # Применяем форматирование
-    patterns = [
-        (r"### \*\*(.*?)\*\*", r"<b><u>\1</u></b>"),  # Заголовки
-        (r"\*\*(.*?)\*\*", r"<b>\1</b>"),              # Жирный текст  
-        (r"\*(.*?)\*", r"<i>\1</i>"),                  # Курсив
-        (r"---", "—————————"),                          # Разделители
-    ]
-    
-    for pattern, replacement in patterns:
-        text = re.sub(pattern, replacement, text)
-    
-    # Возвращаем блоки кода
-    for i, code_block in enumerate(code_blocks):
-        text = text.replace(f"__CODE_BLOCK_{i}__", f"<pre>{html.escape(code_block)}</pre>")
-    
-    return text
-
 # ================================================
 # Универсальные декораторы
 # ================================================
-def get_user_decorator(func: Callable) -> Callable:
+def get_user_decorator(
+    func: Optional[Callable] = None, *, fields: Optional[Iterable[str]] = None
+) -> Callable:
     """Универсальный декоратор для получения пользователя"""
-    @wraps(func)
-    async def wrapper(message: types.Message, db: Database, *args, **kwargs):
-        manager = await db.get_user_manager()
-        user = await manager.get_user(
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.language_code,
-        )
-        return await func(message, db, user=user, *args, **kwargs)
-    return wrapper
+    # fields - дополнительные поля пользователя, нужные обработчику (None - весь документ)
+    def decorator(handler: Callable) -> Callable:
+        @wraps(handler)
+        async def wrapper(message: types.Message, db: Database, *args, **kwargs):
+            manager = await db.get_user_manager()
+            user = await manager.get_user(
+                message.from_user.id,
+                message.from_user.username,
+                message.from_user.language_code,
+                fields=fields,
+            )
+            return await handler(message, db, user=user, *args, **kwargs)
+        return wrapper
+
+    # Поддерживаем использование как @get_user_decorator, так и @get_user_decorator(fields=...)
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 # ================================================
 # Универсальные функции-хелперы
@@ -101,7 +77,7 @@ async def send_localized_message(
     """Универсальная функция для отправки локализованных сообщений"""
     # Получаем username бота динамически если нужно для invite_link
     if "invite_link" not in kwargs:
-        bot_info = await message.bot.get_me()
+        bot_info = await message.bot.me()  # Кэшируется в объекте бота
         invite_link = f"https://t.me/{bot_info.username}?start={user.user_id}"
     else:
         invite_link = kwargs["invite_link"]
@@ -122,7 +98,7 @@ async def send_localized_message(
 
 def create_simple_command_handler(message_key: str) -> Callable:
     """Фабрика для создания простых обработчиков команд"""
-    @get_user_decorator
+    @get_user_decorator(fields=())
     async def handler(message: types.Message, db: Database, user: User):
         await send_localized_message(message, message_key, user)
     return handler
@@ -135,15 +111,75 @@ async def send_response_safely(message: types.Message, response: str) -> None:
         await message.answer("❌ Получен пустой ответ от нейросети. Попробуйте еще раз.")
         return
     
+    # Длинный ответ уходит несколькими сообщениями по порядку
+    await send_chunks_safely(message, split_html(format_to_html(response.strip())))
+
+async def send_chunks_safely(message: types.Message, chunks: List[str]) -> None:
+    # Отправляет части ответа по порядку; после ошибки разметки остаток уходит простым текстом
+    sent = 0
+    try:
+        error = next(filter(None, map(validate_telegram_html, chunks)), None)
+        if error:
+            # Разметку, которую Telegram отклонит, не отправляем - сразу берем простой текст
+            raise ValueError(error)
+        for chunk in chunks:
+            await message.answer(chunk, parse_mode=ParseMode.HTML)
+            sent += 1
+        return
+    except Exception as e:
+        logger.error(f"HTML format error: {str(e)}")
+    
     try:
-        formatted_response = format_to_html(response.strip())
-        await message.answer(formatted_response, parse_mode=ParseMode.HTML)
+        # Если ошибка форматирования, оставшиеся части отправляем простым текстом
+        for chunk in chunks[sent:]:
+            await message.answer(html_to_text(chunk), parse_mode=None)
     except Exception as e:
-        # Если ошибка форматирования, отправляем как есть
+        # Если и это не получается, отправляем базовое сообщение об ошибке
+        await message.answer("❌ Ошибка при отправке ответа.")
+        logger.error(f"Response sending failed completely: {str(e)}")
+
+async def stream_to_message(
+    wait_message: types.Message, chunks: AsyncIterator[str]
+) -> str:
+    # Показывает ответ по мере генерации, редактируя сообщение ожидания
+    # Первый фрагмент показывается сразу, следующие правки - не чаще STREAM_EDIT_INTERVAL,
+    # чтобы не упираться в лимиты Telegram
+    parts = []
+    last_edit = 0.0
+    
+    async for chunk in chunks:
+        parts.append(chunk)
+        if time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            continue
+        
+        # Промежуточный текст отправляем без разметки - он может быть незавершенным
+        preview = "".join(parts)[:TELEGRAM_MESSAGE_LIMIT - len(STREAM_CURSOR)] + STREAM_CURSOR
         try:
-            await message.answer(response.strip())
-        except Exception as e2:
-            # Если и это не получается, отправляем базовое сообщение об ошибке
-            await message.answer("❌ Ошибка при отправке ответа.")
-            logger.error(f"Response sending failed completely: {str(e2)}")
-        logger.error(f"HTML format error: {str(e)}")
+            await wait_message.edit_text(preview, parse_mode=None)
+        except TelegramBadRequest as e:
+            logger.debug(f"Stream preview edit skipped: {str(e)}")
+        last_edit = time.monotonic()
+    
+    return "".join(parts)
+
+async def deliver_response(
+    message: types.Message, wait_message: types.Message, response: str
+) -> None:
+    # Финальный ответ с HTML-форматированием замещает сообщение ожидания
+    # Первая часть длинного ответа редактирует его, остальные отправляются следом
+    chunks = split_html(format_to_html(response.strip())) if response and response.strip() else []
+    if chunks and not any(map(validate_telegram_html, chunks)):
+        try:
+            await wait_message.edit_text(chunks[0], parse_mode=ParseMode.HTML)
+        except TelegramBadRequest as e:
+            logger.warning(f"Final edit failed, sending new message: {str(e)}")
+        else:
+            # Первая часть уже показана - при сбое досылаем только оставшиеся части
+            await send_chunks_safely(message, chunks[1:])
+            return
+    
+    try:
+        await wait_message.delete()
+    except TelegramBadRequest:
+        pass
+    await send_response_safely(message, response)
@@ -1,14 +1,19 @@
-from datetime import datetime, timedelta
-
 from aiogram import F, Router, types
 from aiogram.filters import Command, CommandObject
-from aiogram.exceptions import TelegramBadRequest
 
-from bot.database.database import Database
+from bot.database.database import Database, USER_OPTIONAL_FIELDS
 from bot.database.models import User
 from bot.keyboards.keyboards import get_models_keyboard
+from bot.services.admission import get_admission_stats
+from bot.services.broadcast import BroadcastService
+from bot.services.hedging import get_hedge_stats
+from bot.services.images import image_cache
+from bot.services.outbound import PRIORITY_NOTIFICATION, outbound_priority, outbound_scheduler
+from bot.services.prompt_cache import prompt_cache_usage
+from bot.services.response_cache import response_cache
+from bot.services.resilience import get_circuit_stats
 from bot.utils.localization import get_text
-from config import YOUR_ADMIN_ID, REFERRAL_TOKENS
+from config import YOUR_ADMIN_ID, REFERRAL_TOKENS, BROADCAST_CHUNK_SIZE
 
 from .base import (
     get_user_decorator, send_localized_message, create_simple_command_handler, logger
@@ -32,14 +37,24 @@ async def process_referral(message: types.Message, user: User, db: Database) ->
             await message.answer("❌ Ви не можете запросити самого себе!")
             return
 
-        inviter = await db.users.find_one({"user_id": inviter_id})
-        if not inviter or message.from_user.id in inviter.get("invited_users", []):
+        # Проверяем приглашение на стороне сервера, не загружая весь список invited_users
+        inviter = await db.users.find_one(
+            {"user_id": inviter_id},
+            {
+                "_id": 0,
+                "invited_count": USER_OPTIONAL_FIELDS["invited_count"],
+                "already_invited": {
+                    "$in": [message.from_user.id, {"$ifNull": ["$invited_users", []]}]
+                },
+            },
+        )
+        if not inviter or inviter["already_invited"]:
             return
 
         manager = await db.get_user_manager()
         await manager.add_invited_user(inviter_id, message.from_user.id)
         await send_inviter_notification(
-            inviter_id, len(inviter.get("invited_users", []) + 1), db, message.bot
+            inviter_id, inviter["invited_count"] + 1, db, message.bot
         )
     except (ValueError, TypeError) as e:
         logger.error(f"Помилка обробки реферала: {str(e)}")
@@ -50,7 +65,7 @@ async def send_inviter_notification(
     """Отправка уведомления пригласившему пользователю"""
     manager = await db.get_user_manager()
     user = await manager.get_user(
-        inviter_id, None, "en"
+        inviter_id, None, "en", fields=()
     )  # Username не нужен для уведомления
     text = await send_localized_message(
         None,
@@ -60,13 +75,36 @@ async def send_inviter_notification(
         referral_tokens=REFERRAL_TOKENS,
         return_text=True,
     )
-    await bot.send_message(inviter_id, text)
+    with outbound_priority(PRIORITY_NOTIFICATION):
+        await bot.send_message(inviter_id, text)
+
+def format_stats(sections: dict) -> str:
+    # Форматирует словари счетчиков в текст для администратора
+    lines = []
+    for title, stats in sections.items():
+        lines.append(f"<b>{title}</b>")
+        lines.extend(f"{key}: {value}" for key, value in stats.items())
+        lines.append("")
+    return "\n".join(lines).strip()
 
 # ================================================
 # Команды бота
 # ================================================
+def make_broadcast_reporter(status_message: types.Message):
+    # Прогресс рассылки отображается редактированием одного сообщения администратора
+    async def report(progress: dict) -> None:
+        title = "Рассылка завершена" if progress["finished"] else "Рассылка выполняется"
+        await status_message.edit_text(
+            f"{title}\n"
+            f"Отправлено сообщений: {progress['sent']}, не удалось отправить: {progress['failed']}\n"
+            f"Скорость: {progress['rate']:.1f} сообщ./с, прошло {progress['elapsed']:.0f} с"
+        )
+    return report
+
 @router.message(Command("send_all"))
-async def admin_send_all(message: types.Message, command: CommandObject, db: Database):
+async def admin_send_all(
+    message: types.Message, command: CommandObject, db: Database, broadcasts: BroadcastService
+):
     """Административная команда для массовой рассылки"""
     if message.from_user.id != YOUR_ADMIN_ID:
         await message.answer("У вас нет прав для выполнения этой команды")
@@ -76,22 +114,74 @@ async def admin_send_all(message: types.Message, command: CommandObject, db: Dat
         await message.answer("Использование: /send_all текст сообщения")
         return
 
-    text = command.args
-    users = await db.users.find({}).to_list(None)
-    success_count = 0
-    failed_count = 0
-
-    for user in users:
-        try:
-            await message.bot.send_message(user["user_id"], text)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения пользователю {user['user_id']}: {str(e)}")
-            failed_count += 1
-
-    await message.answer(
-        f"Отправлено сообщений: {success_count}, не удалось отправить: {failed_count}"
+    if broadcasts.is_running():
+        await message.answer("Рассылка уже выполняется")
+        return
+
+    status_message = await message.answer("Рассылка запущена")
+    await broadcasts.start(message.bot, command.args, make_broadcast_reporter(status_message))
+
+@router.message(Command("send_all_resume"))
+async def admin_send_all_resume(
+    message: types.Message, command: CommandObject, broadcasts: BroadcastService
+):
+    """Возобновление прерванной рассылки (последней или по id) с последней контрольной точки"""
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.answer("У вас нет прав для выполнения этой команды")
+        return
+
+    if broadcasts.is_running():
+        await message.answer("Рассылка уже выполняется")
+        return
+
+    unfinished = await broadcasts.find_unfinished()
+    if not unfinished:
+        await message.answer("Нет незавершенных рассылок")
+        return
+
+    broadcast_id = command.args.strip() if command.args else None
+    if broadcast_id is None and len(unfinished) > 1:
+        # Несколько прерванных рассылок - администратор выбирает, какую продолжить
+        lines = ["Незавершенные рассылки (возобновить: /send_all_resume id):"]
+        lines.extend(
+            f"{item['_id']} от {item['created_at']:%Y-%m-%d %H:%M}, отправлено {item['sent']}: "
+            f"{item['text'][:40]}"
+            for item in unfinished
+        )
+        await message.answer("\n".join(lines), parse_mode=None)
+        return
+
+    status_message = await message.answer(
+        "Возобновляем рассылку. Получатели последней незавершенной пачки "
+        f"(до {BROADCAST_CHUNK_SIZE}) могут получить сообщение повторно"
     )
+    if not await broadcasts.resume(message.bot, make_broadcast_reporter(status_message), broadcast_id):
+        await status_message.edit_text(f"Незавершенная рассылка {broadcast_id} не найдена")
+
+@router.message(Command("stats"))
+async def admin_stats(message: types.Message, db: Database):
+    """Административная команда: счетчики кэшей и очередей"""
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.answer("У вас нет прав для выполнения этой команды")
+        return
+
+    manager = await db.get_user_manager()
+    sections = {
+        "Кэш пользователей": manager.cache.stats(),
+        "Кэш анализа изображений": image_cache.stats(),
+        "Исходящие запросы Telegram": outbound_scheduler.stats(),
+    }
+    for name, stats in get_admission_stats().items():
+        sections[f"Очередь {name}"] = stats
+    for provider, stats in get_circuit_stats().items():
+        sections[f"Автомат {provider}"] = stats
+    for model, stats in get_hedge_stats().items():
+        sections[f"Хеджирование {model}"] = stats
+    if prompt_cache_usage.requests:
+        sections["Кэш промптов Anthropic"] = prompt_cache_usage.stats()
+    if response_cache.enabled:
+        sections["Кэш ответов"] = await response_cache.stats()
+    await message.answer(format_stats(sections))
 
 @router.message(Command("start"))
 async def start_command(message: types.Message, db: Database):
@@ -101,6 +191,7 @@ async def start_command(message: types.Message, db: Database):
         message.from_user.id,
         message.from_user.username,
         message.from_user.language_code,
+        fields=(),
     )
 
     # Обрабатываем реферальную ссылку если есть
@@ -110,7 +201,7 @@ async def start_command(message: types.Message, db: Database):
     await send_localized_message(message, "start", user)
 
 @router.message(Command("invite"))
-@get_user_decorator
+@get_user_decorator(fields=("invited_count",))
 async def invite_command(message: types.Message, db: Database, user: User):
     # Команда для получения реферальной ссылки с информацией о наградах
     bot_info = await message.bot.get_me()
@@ -119,25 +210,26 @@ async def invite_command(message: types.Message, db: Database, user: User):
     await send_localized_message(
         message, "invite_info", user,
         invite_link=invite_link,
-        invited_count=len(user.invited_users),
+        invited_count=user.get_invited_count(),
         referral_tokens=REFERRAL_TOKENS
     )
 
 @router.message(Command("profile"))
-@get_user_decorator
+@get_user_decorator(fields=("current_agent",))
 async def profile_command(message: types.Message, db: Database, user: User):
     """Показать профиль пользователя с информацией о текущем режиме"""
     # Get current agent and mode info
     current_agent = user.get_current_agent()
-    current_history = user.get_current_history()
+    manager = await db.get_user_manager()
+    history_count = await manager.count_history(
+        user.user_id, current_agent.agent_id if current_agent else None
+    )
     
     if current_agent:
         current_mode = get_text("profile_mode_agent", user.language_code, agent_name=current_agent.name)
     else:
         current_mode = get_text("profile_mode_default", user.language_code)
     
-    history_count = len(current_history)
-    
     await send_localized_message(
         message, "profile", user,
         current_mode=current_mode,
@@ -150,7 +242,7 @@ async def help_command(message: types.Message, db: Database):
     await create_simple_command_handler("help")(message, db)
 
 @router.message(Command("reset"))
-@get_user_decorator
+@get_user_decorator(fields=("current_agent",))
 async def reset_command(message: types.Message, db: Database, user: User):
     """Очистить историю сообщений для текущего контекста"""
     manager = await db.get_user_manager()
@@ -171,7 +263,7 @@ async def reset_command(message: types.Message, db: Database, user: User):
         await send_localized_message(message, "history_reset_default", user)
 
 @router.message(Command("models"))
-@get_user_decorator
+@get_user_decorator(fields=())
 async def models_command(message: types.Message, db: Database, user: User):
     """Показать доступные модели"""
     await send_localized_message(
@@ -180,7 +272,7 @@ async def models_command(message: types.Message, db: Database, user: User):
     )
 
 @router.callback_query(F.data.startswith("model_"))
-@get_user_decorator
+@get_user_decorator(fields=())
 async def change_model_handler(callback: types.CallbackQuery, db: Database, user: User):
     """Изменить текущую модель"""
     model = callback.data.split("_")[1]
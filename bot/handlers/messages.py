@@ -1,4 +1,4 @@
-import os
+import asyncio
 from datetime import datetime, timedelta
 
 from aiogram import Router, types
@@ -7,11 +7,17 @@ from aiogram.exceptions import TelegramBadRequest
 
 from bot.database.database import Database
 from bot.database.models import User
-from bot.services.ai_service import AIService
+from bot.services.admission import get_request_priority
+from bot.services.ai_service import AIService, IMAGE_ANALYSIS_PROMPT, get_answering_model, is_cacheable
+from bot.services.errors import AIServiceError, EmptyResponseError, ProviderBusyError
+from bot.services.images import image_cache, pick_photo_size
 from bot.prompts import DEFAULT_SYSTEM_PROMPT
+from bot.services.context_builder import build_context, get_history_budget
+from bot.services.summarizer import ConversationSummarizer, append_summary
+from config import HISTORY_FETCH_LIMIT, STREAM_RESPONSES, SUMMARIES_ENABLED, HEDGE_REQUESTS
 
 from .base import (
-    get_user_decorator, send_localized_message, send_response_safely,
+    get_user_decorator, send_localized_message, stream_to_message, deliver_response,
     MODEL_SERVICES, logger
 )
 from .agents import handle_agent_creation_conversation
@@ -41,43 +47,32 @@ def get_ai_service(model_name: str) -> AIService:
         MODEL_SERVICES[model_name] = AIService(model_name=model_name)
     return MODEL_SERVICES[model_name]
 
-async def process_image_message(message: types.Message, service: AIService) -> str:
+async def process_image_message(message: types.Message, service: AIService, priority: int) -> str:
     """Обработка сообщения с изображением"""
-    photo = message.photo[-1]
-    file = await message.bot.get_file(photo.file_id)
-    file_path = f"temp_{message.from_user.id}_{photo.file_id}.jpg"
+    # Скачиваем в память наименьший вариант фото, которого хватает модели
+    photo = pick_photo_size(message.photo, service.provider)
     
-    try:
-        await message.bot.download_file(file.file_path, file_path)
-        response = await service.read_image(file_path)
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # Повторно пересланное фото не скачиваем и не анализируем заново
+    cached = image_cache.get(photo.file_unique_id, service.model_name, IMAGE_ANALYSIS_PROMPT)
+    if cached:
+        return cached
     
+    image = (await message.bot.download(photo)).getvalue()
+    response = await service.read_image(image, priority=priority)
+    if is_cacheable(response):
+        image_cache.store(
+            photo.file_unique_id, service.model_name, IMAGE_ANALYSIS_PROMPT, response, len(image)
+        )
     return response
 
-def prepare_context_from_history(history: list) -> list:
-    # Подготовка контекста из истории сообщений
-    context = []
-    for i, entry in enumerate(history[-5:]):
-        content_key = "message" if i % 2 == 0 else "response"
-        content = entry.get(content_key, "")
-        
-        # Пропускаем сообщения с пустым содержимым
-        if content and content.strip():
-            context.append({
-                "role": "user" if i % 2 == 0 else "assistant",
-                "content": content.strip(),
-            })
-    
-    return context
-
 # ================================================
 # Главный обработчик сообщений
 # ================================================
 @router.message()
-@get_user_decorator
-async def handle_message(message: types.Message, db: Database, user: User):
+@get_user_decorator(fields=("current_agent", "invited_count"))
+async def handle_message(
+    message: types.Message, db: Database, user: User, summarizer: ConversationSummarizer
+):
     """Главный обработчик всех сообщений пользователей"""
     
     # Check if user is in conversation state (agent creation/editing)
@@ -85,71 +80,125 @@ async def handle_message(message: types.Message, db: Database, user: User):
         return
     
     tokens_cost = 1
+    manager = await db.get_user_manager()
     
-    # Проверка баланса
-    if user.balance < tokens_cost:
+    # Атомарно резервируем токены до вызова нейросети
+    if not await manager.reserve_tokens(user.user_id, tokens_cost):
         next_day = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
         await send_localized_message(message, "no_tokens", user, next_day=next_day)
         return
 
-    wait_message = await message.answer("⏳")
+    wait_message = None
+    response_received = False
 
     try:
+        wait_message = await message.answer("⏳")
         await message.bot.send_chat_action(message.chat.id, ChatAction.TYPING)
         
         service = get_ai_service(user.current_model)
+        # Место в очереди к модели: текст раньше изображений, пригласившие друзей раньше остальных
+        priority = get_request_priority(user.invited_count, is_image=bool(message.photo))
         
         # Get system prompt from current agent if available
         current_agent = user.get_current_agent()
+        agent_id = current_agent.agent_id if current_agent else None
         
-        # Добавляем ограничение длины ответа для всех запросов
-        length_constraint = "ВАЖНО: Ответ должен быть не длиннее 4000 символов. Если нужно показать длинный код - сократи его или покажи только ключевые части."
-        
-        if current_agent:
-            # Используем промпт агента
-            system_prompt = f"{current_agent.system_prompt}\n\n{length_constraint}"
-        else:
-            # Используем стандартный системный промпт
-            system_prompt = f"{DEFAULT_SYSTEM_PROMPT}\n\n{length_constraint}"
+        # Длинные ответы делятся на несколько сообщений при отправке - ограничение длины в промпте не нужно
+        system_prompt = current_agent.system_prompt if current_agent else DEFAULT_SYSTEM_PROMPT
 
         # Обработка сообщения в зависимости от типа
         if message.photo:
-            response = await process_image_message(message, service)
+            response = await process_image_message(message, service, priority)
             content = ""
         else:
             content = message.text
             
+            # Ранние ходы длинного диалога передаются сводкой в системном промпте
+            summary = await manager.get_summary(user.user_id, agent_id) if SUMMARIES_ENABLED else None
+            system_prompt = append_summary(system_prompt, summary)
+            
+            # Целые ходы диалога (агента или режима по умолчанию) от новых к старым в пределах бюджета токенов модели
+            current_history = await manager.get_history(
+                user.user_id, agent_id, HISTORY_FETCH_LIMIT,
+                after=summary["summarized_until"] if summary else None
+            )
+            context = build_context(
+                current_history,
+                get_history_budget(user.current_model, system_prompt.text, content)
+            )
+            
             if current_agent:
-                # Используем OpenAI Agents для кастомных агентов
-                response = await service.get_agent_response(
-                    agent_name=current_agent.name,
-                    system_prompt=system_prompt,
-                    message=content
+                # Агент отвечает с учетом своей истории через тот же конвейер запросов
+                request = dict(
+                    agent_id=current_agent.agent_id, agent_name=current_agent.name,
+                    system_prompt=system_prompt, message=content, context=context, priority=priority
+                )
+                if STREAM_RESPONSES:
+                    response = await stream_to_message(wait_message, service.stream_agent_response(**request))
+                else:
+                    response = await service.get_agent_response(**request)
+            elif STREAM_RESPONSES:
+                # Показываем ответ по мере генерации в сообщении ожидания
+                response = await stream_to_message(
+                    wait_message,
+                    service.stream_response(
+                        content, context=context, system_prompt=system_prompt,
+                        priority=priority, hedge=HEDGE_REQUESTS
+                    )
                 )
             else:
                 # Стандартная обработка для режима по умолчанию
-                current_history = user.get_current_history()
-                context = prepare_context_from_history(current_history)
                 response = await service.get_response(
-                    content, context=context, system_prompt=system_prompt
+                    content, context=context, system_prompt=system_prompt,
+                    priority=priority, hedge=HEDGE_REQUESTS
                 )
+        response_received = True
 
-        # Обновление баланса и истории (включаем информацию об агенте)
-        manager = await db.get_user_manager()
-        model_info = user.current_model
+        # Сохраняем историю (токены уже списаны резервом)
+        # При хеджировании ответ могла дать запасная модель - подписываем его фактической моделью
+        model_info = get_answering_model(user.current_model)
         if current_agent:
             model_info += f" (Agent: {current_agent.name})"
         
-        await manager.update_balance_and_history(
-            user.user_id, tokens_cost, model_info, content, response, 
-            agent_id=current_agent.agent_id if current_agent else None
+        await manager.save_history(
+            user.user_id, model_info, content, response, agent_id=agent_id
         )
+        # Сводка обновляется в фоне и не влияет на задержку ответа
+        if SUMMARIES_ENABLED:
+            summarizer.schedule(user.user_id, agent_id)
+
+        # Заменяем сообщение ожидания финальным отформатированным ответом
+        await deliver_response(message, wait_message, response)
 
-        # Безопасно удаляем сообщение ожидания и отправляем ответ
-        await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
-        await send_response_safely(message, response)
+    except ProviderBusyError as e:
+        # Модель перегружена - быстро отказываем (токены вернутся в finally)
+        if wait_message:
+            await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
+        logger.warning(f"Message rejected: {str(e)}")
+        await send_localized_message(message, "provider_busy", user)
+
+    except EmptyResponseError as e:
+        # Модель ответила без текста - списывать и сохранять нечего
+        if wait_message:
+            await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
+        logger.warning(f"Empty response: {str(e)}")
+        await send_localized_message(message, "empty_response", user)
+
+    except AIServiceError as e:
+        # Провайдер не ответил после повторов - ошибку в историю не пишем
+        if wait_message:
+            await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
+        logger.error(f"Provider request failed: {str(e)}")
+        await send_localized_message(message, "provider_error", user)
 
     except Exception as e:
-        await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
+        if wait_message:
+            await safe_delete_message(message.bot, message.chat.id, wait_message.message_id)
         logger.error(f"Message handling failed: {str(e)}")
         await message.answer(f"Помилка обробки повідомлення: {str(e)}")
+
+    finally:
+        # Ответ не получен (ошибка или отмена задачи при остановке) - возвращаем зарезервированные токены
+        # shield: возврат завершится, даже если задачу отменят повторно
+        if not response_received:
+            await asyncio.shield(manager.refund_tokens(user.user_id, tokens_cost))
@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from bot.services.errors import ProviderBusyError
+from bot.utils.logger import setup_logger
+from config import (
+    MODEL_MAX_IN_FLIGHT, DEFAULT_MAX_IN_FLIGHT, PROVIDER_MAX_QUEUE, PROVIDER_QUEUE_TIMEOUT
+)
+
+# ================================================
+# Логгер для контроля допуска запросов
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Приоритеты запросов (меньше - раньше)
+# ================================================
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE = 2
+PRIORITY_BACKGROUND = 4  # Фоновые задачи (сводки) уступают всем пользователям
+WAIT_SAMPLES = 500  # Сколько последних ожиданий хранить для перцентилей
+
+
+def get_request_priority(invited_count: Optional[int], is_image: bool = False) -> int:
+    # Текст раньше изображений, внутри типа - пригласившие друзей раньше остальных
+    base = PRIORITY_IMAGE if is_image else PRIORITY_TEXT
+    return base if invited_count else base + 1
+
+
+class AdmissionController:
+    """Ограничение одновременных запросов к модели с приоритетной очередью ожидания"""
+
+    def __init__(self, provider: str, model: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.provider = provider
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout or None
+        self._in_flight = 0
+        self._queued = 0
+        # Куча (приоритет, порядок поступления, future); отмененные записи удаляются лениво
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self, priority: int) -> None:
+        """Занимает слот на время одной попытки запроса к провайдеру"""
+        started = time.monotonic()
+        if self._in_flight < self.max_in_flight and not self._queued:
+            self._in_flight += 1
+            self._record_admission(started)
+            return
+
+        # Очередь заполнена - сразу отказываем, а не копим задержку для всех
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Очередь {self.provider}/{self.model} заполнена ({self._queued}), запрос отклонен")
+            raise ProviderBusyError(self.provider, self.model)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._queued += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот успели передать в момент отмены - возвращаем его следующему
+                self.release()
+            else:
+                self._queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                logger.warning(f"Истекло ожидание слота {self.provider}/{self.model}")
+                raise ProviderBusyError(self.provider, self.model) from None
+            raise
+        self._record_admission(started)
+
+    def release(self) -> None:
+        # Слот переходит первому живому ожидающему, иначе освобождается
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._queued -= 1
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _record_admission(self, started: float) -> None:
+        self.admitted += 1
+        self._waits.append(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, int]:
+        """Глубина очереди и время ожидания слота"""
+        waits = sorted(self._waits)
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_ms": round(sum(waits) * 1000 / len(waits)) if waits else 0,
+            "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000) if waits else 0,
+            "wait_max_ms": round(waits[-1] * 1000) if waits else 0,
+        }
+
+
+# ================================================
+# Контроллеры допуска по провайдеру и модели
+# ================================================
+_controllers: Dict[Tuple[str, str], AdmissionController] = {}
+
+
+def get_admission_controller(provider: str, model: str) -> AdmissionController:
+    key = (provider, model)
+    if key not in _controllers:
+        _controllers[key] = AdmissionController(
+            provider, model,
+            max_in_flight=MODEL_MAX_IN_FLIGHT.get(model, DEFAULT_MAX_IN_FLIGHT),
+            max_queue=PROVIDER_MAX_QUEUE,
+            queue_timeout=PROVIDER_QUEUE_TIMEOUT,
+        )
+    return _controllers[key]
+
+
+def get_admission_stats() -> Dict[str, Dict[str, int]]:
+    return {f"{provider}/{model}": controller.stats() for (provider, model), controller in _controllers.items()}
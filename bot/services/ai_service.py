@@ -1,14 +1,20 @@
-import base64
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any, Union
 from functools import wraps
 
-import openai
-import anthropic
-
-from config import OPENAI_API_KEY, ANTHROPIC_API_KEY, GPT_MODEL, MAX_TOKENS
+from config import GPT_MODEL, MAX_TOKENS, ANTHROPIC_API_KEY, HEDGE_MODELS
+from bot.services.admission import PRIORITY_TEXT, PRIORITY_IMAGE, get_admission_controller
+from bot.services.clients import provider_clients
+from bot.services.errors import AIServiceError, EmptyResponseError, ProviderRequestError
+from bot.services.hedging import get_hedge_controller
+from bot.services.images import IMAGE_MEDIA_TYPE, encode_image
+from bot.services.prompt_cache import (
+    SystemPrompt, as_system_prompt, build_claude_system, mark_claude_history, prompt_cache_usage
+)
+from bot.services.response_cache import make_cache_key, response_cache
+from bot.services.resilience import build_retrying, get_circuit_breaker
 from bot.utils.logger import setup_logger
-from bot.database.models import Agent
 
 
 # ================================================
@@ -16,106 +22,43 @@ from bot.database.models import Agent
 # ================================================
 IMAGE_ANALYSIS_PROMPT = "Опиши это изображение:"
 ERROR_ANTHROPIC_KEY_MISSING = "Ошибка: API ключ Anthropic не настроен"
-ERROR_OPERATION_FAILED = "Ошибка при выполнении операции"
+TRUNCATED_RESPONSE_MESSAGE = "⚠️ Ответ был обрезан из-за лимита токенов. Попробуйте задать более короткий вопрос или очистите историю командой /reset."
 
 # ================================================
 # Логгер для сервиса ИИ
 # ================================================
 logger = setup_logger(__name__)
 
+# Модель, ответившая на последний запрос в текущей задаче (при хеджировании - возможно, запасная)
+_answered_by: ContextVar[Optional[str]] = ContextVar("answered_by", default=None)
+
+
+def get_answering_model(default: str) -> str:
+    """Модель, которая дала последний ответ в текущей задаче обработчика"""
+    return _answered_by.get() or default
 
-# ================================================
-# Сервис для работы с асинхронными агентами (OpenAI + Claude)
-# ================================================
-class AgentService:
-    """Сервис для создания и управления асинхронными агентами"""
-    
-    def __init__(self, openai_client, anthropic_client=None):
-        # Инициализация сервиса агентов с клиентами для разных провайдеров
-        self._agents_cache = {}
-        self.openai_client = openai_client
-        self.anthropic_client = anthropic_client
-    
-    def create_agent(self, name: str, instructions: str) -> Agent:
-        """Создает нового агента с указанными инструкциями"""
-        agent_key = f"{name}_{hash(instructions)}"
-        
-        if agent_key not in self._agents_cache:
-            logger.info(f"🤖 Создаем нового агента: {name}")
-            agent = Agent(
-                agent_id=Agent.generate_id(),
-                name=name,
-                system_prompt=instructions,
-                created_at=datetime.now()
-            )
-            self._agents_cache[agent_key] = agent
-            logger.debug(f"   Агент создан с инструкциями: {instructions[:100]}...")
-        
-        return self._agents_cache[agent_key]
-    
-    async def get_agent_response(self, agent: Agent, message: str, model: str = None) -> str:
-        """Получает ответ от агента асинхронно"""
-        try:
-            logger.info(f"📤 Отправляем запрос агенту {agent.name}")
-            logger.debug(f"   Сообщение: {message[:100]}...")
-            
-            # Определяем используемую модель
-            current_model = model or GPT_MODEL
-            is_claude = "claude" in current_model.lower()
-            
-            # Подготавливаем сообщения
-            messages = [
-                {"role": "user", "content": message}
-            ]
-            
-            if is_claude and self.anthropic_client:
-                # Для Claude используем Anthropic API
-                logger.debug(f"   Используем Claude модель: {current_model}")
-                response = await self.anthropic_client.messages.create(
-                    model=current_model,
-                    max_tokens=MAX_TOKENS,
-                    messages=messages,
-                    system=agent.system_prompt  # Системный промпт отдельно для Claude
-                )
-                result = response.content[0].text
-            else:
-                # Для OpenAI добавляем системный промпт в сообщения
-                messages.insert(0, {"role": "system", "content": agent.system_prompt})
-                logger.debug(f"   Используем OpenAI модель: {current_model}")
-                response = await self.openai_client.chat.completions.create(
-                    model=current_model,
-                    messages=messages,
-                    max_completion_tokens=MAX_TOKENS
-                )
-                result = response.choices[0].message.content
-            
-            logger.info(f"🤖 Агент {agent.name} ответил")
-            logger.debug(f"   Ответ: {result[:100]}...")
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка при работе с агентом {agent.name}: {e}")
-            return f"Ошибка агента: {str(e)}"
+
+def is_cacheable(response: str) -> bool:
+    # Обрезанные ответы не кэшируем - повторный запрос может дать полный ответ
+    return bool(response) and TRUNCATED_RESPONSE_MESSAGE not in response
 
 
 def error_handler(func):
-    # Декоратор для унификации обработки ошибок
+    # Декоратор для проверки пустых ответов
+    # Сбои провайдера и пустые ответы не превращаются в текст ответа, а поднимаются как AIServiceError,
+    # чтобы обработчик вернул токены и не сохранял ошибку в историю
     @wraps(func)
-    async def wrapper(*args, **kwargs):
-        try:
-            result = await func(*args, **kwargs)
-            # Проверяем что результат не пустой
-            if not result or not str(result).strip():
-                logger.warning("🚨 ПУСТОЙ ОТВЕТ ОТ НЕЙРОСЕТИ:")
-                logger.warning(f"   Тип результата: {type(result)}")
-                logger.warning(f"   Значение: {repr(result)}")
-                logger.warning(f"   Длина: {len(str(result)) if result else 0}")
-                logger.warning(f"   Функция: {func.__name__}")
-                return "Нейросеть вернула пустой ответ. Попробуйте переформулировать вопрос."
-            return result
-        except Exception as e:
-            return f"{ERROR_OPERATION_FAILED}: {str(e)}"
+    async def wrapper(self, *args, **kwargs):
+        result = await func(self, *args, **kwargs)
+        # Проверяем что результат не пустой
+        if not result or not str(result).strip():
+            logger.warning("🚨 ПУСТОЙ ОТВЕТ ОТ НЕЙРОСЕТИ:")
+            logger.warning(f"   Тип результата: {type(result)}")
+            logger.warning(f"   Значение: {repr(result)}")
+            logger.warning(f"   Длина: {len(str(result)) if result else 0}")
+            logger.warning(f"   Функция: {func.__name__}")
+            raise EmptyResponseError(self.provider, self.model_name)
+        return result
     return wrapper
 
 
@@ -127,23 +70,53 @@ class AIService:
         self.model_name = model_name or GPT_MODEL
         
         # ================================================
-        # Инициализация клиентов
+        # Ограничение одновременных запросов и автомат отключения провайдера
         # ================================================
-        self.openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
-        self.anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+        self.provider = "anthropic" if self.is_claude_model() else "openai"
+        self.admission = get_admission_controller(self.provider, self.model_name)
+        self.breaker = get_circuit_breaker(self.provider)
         
         # ================================================
-        # Сервис агентов (OpenAI + Claude)
+        # Хеджирование медленных запросов на запасную модель
         # ================================================
-        self.agent_service = AgentService(self.openai_client, self.anthropic_client)
+        self.hedger = get_hedge_controller(self.model_name)
+        self._hedge_service: Optional["AIService"] = None
+    
+    @property
+    def openai_client(self):
+        # Общие клиенты провайдеров создаются при первом запросе к модели
+        return provider_clients.openai
+    
+    @property
+    def anthropic_client(self):
+        return provider_clients.anthropic
     
     def is_claude_model(self) -> bool:
         # Проверяет, является ли текущая модель Claude
         return self.model_name and "claude" in self.model_name.lower()
     
+    def get_hedge_service(self) -> Optional["AIService"]:
+        # Сервис запасной модели другого провайдера (None - хеджировать некуда)
+        hedge_model = HEDGE_MODELS.get(self.model_name)
+        if not hedge_model or hedge_model == self.model_name:
+            return None
+        if "claude" in hedge_model.lower() and not ANTHROPIC_API_KEY:
+            return None
+        if self._hedge_service is None:
+            self._hedge_service = AIService(model_name=hedge_model)
+        return self._hedge_service
+    
+    def _get_cache_key(
+        self, message: str, context: Optional[List[Dict[str, str]]], system_prompt: Optional[SystemPrompt]
+    ) -> Optional[str]:
+        # Ключ кэша ответов (None - кэш выключен)
+        if not response_cache.enabled:
+            return None
+        return make_cache_key(self.model_name, system_prompt.text if system_prompt else None, context, message)
+    
     def _prepare_messages(
         self, content: Union[str, List[Dict]], context: List[Dict[str, str]] = None, 
-        system_prompt: str = None
+        system_prompt: Optional[SystemPrompt] = None
     ) -> List[Dict[str, str]]:
         # Унифицированная подготовка сообщений для всех типов контента
         if context is None:
@@ -158,17 +131,50 @@ class AIService:
         user_message = {"role": "user", "content": content}
         messages = filtered_context + [user_message]
         
-        if system_prompt and system_prompt.strip():
-            messages.insert(0, {"role": "system", "content": system_prompt.strip()})
+        if system_prompt and system_prompt.text:
+            messages.insert(0, {"role": "system", "content": system_prompt.text})
         
         return messages
     
+    def _request_error(self, error: Exception) -> ProviderRequestError:
+        return ProviderRequestError(self.provider, self.model_name, f"{type(error).__name__}: {str(error)}")
+    
+    async def _call_provider(
+        self, request: Callable[[], Awaitable[Any]], priority: int, keep_slot: bool = False
+    ) -> Any:
+        # Запрос к провайдеру с повторами временных сбоев (429, 5xx, таймауты)
+        # и быстрым отказом, пока автомат провайдера разомкнут
+        # Слот допуска занимается на каждую попытку и освобождается до паузы перед повтором;
+        # keep_slot - слот остается занятым после успеха (поток), освобождает вызывающий код
+        try:
+            async for attempt in build_retrying():
+                with attempt:
+                    self.breaker.check(self.model_name)
+                    await self.admission.acquire(priority)
+                    try:
+                        result = await request()
+                    except BaseException as e:
+                        self.admission.release()
+                        if isinstance(e, Exception):
+                            self.breaker.record(e)
+                        raise
+                    if not keep_slot:
+                        self.admission.release()
+                    self.breaker.record(None)
+                    return result
+        except AIServiceError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Запрос к {self.provider} ({self.model_name}) не удался: {str(e)}")
+            raise self._request_error(e) from e
+    
     @error_handler
     async def _make_api_call(
-        self, messages: List[Dict[str, str]], system_prompt: str = None
+        self, messages: List[Dict[str, str]], system_prompt: Optional[SystemPrompt] = None,
+        priority: int = PRIORITY_TEXT
     ) -> str:
         # Универсальный метод для API вызовов к любому провайдеру
-        logger.info(f"📤 Отправляем запрос к нейросети:")
+        logger.info("📤 Отправляем запрос к нейросети:")
         logger.info(f"   Модель: {self.model_name}")
         logger.info(f"   Количество сообщений: {len(messages)}")
         
@@ -181,25 +187,30 @@ class AIService:
         
         if self.is_claude_model():
             if not self.anthropic_client:
-                return ERROR_ANTHROPIC_KEY_MISSING
+                raise ProviderRequestError(self.provider, self.model_name, ERROR_ANTHROPIC_KEY_MISSING)
             
             # Убираем системный промпт из сообщений для Claude
             claude_messages = [msg for msg in messages if msg["role"] != "system"]
             
-            response = await self.anthropic_client.messages.create(
+            response = await self._call_provider(lambda: self.anthropic_client.messages.create(
                 model=self.model_name,
                 max_tokens=MAX_TOKENS,
-                messages=claude_messages,
-                system=system_prompt or ""
-            )
-            result = response.content[0].text
-            logger.info(f"🤖 Claude API ответ:")
+                messages=mark_claude_history(claude_messages),
+                system=build_claude_system(system_prompt)
+            ), priority)
+            prompt_cache_usage.record(self.model_name, response.usage)
+            result = response.content[0].text if response.content else ""
+            logger.info("🤖 Claude API ответ:")
             logger.debug(f"   Модель: {self.model_name}")
             logger.debug(f"   Тип response.content: {type(response.content)}")
             logger.debug(f"   Длина content: {len(response.content)}")
             logger.debug(f"   Первый элемент: {repr(response.content[0]) if response.content else 'None'}")
             logger.debug(f"   Текст результата: {repr(result)}")
             logger.debug(f"   Длина текста: {len(result) if result else 0}")
+            
+            # Обрезанный ответ отдаем с предупреждением, как в потоковом режиме
+            if response.stop_reason == "max_tokens" and result:
+                return f"{result}\n\n{TRUNCATED_RESPONSE_MESSAGE}"
             return result
         else:
             # OpenAI
@@ -209,11 +220,13 @@ class AIService:
                 "max_completion_tokens": MAX_TOKENS
             }
             
-            response = await self.openai_client.chat.completions.create(**params)
+            response = await self._call_provider(
+                lambda: self.openai_client.chat.completions.create(**params), priority
+            )
             result = response.choices[0].message.content
             finish_reason = response.choices[0].finish_reason
             
-            logger.info(f"🤖 OpenAI API ответ:")
+            logger.info("🤖 OpenAI API ответ:")
             logger.debug(f"   Модель: {self.model_name}")
             logger.debug(f"   Finish reason: {finish_reason}")
             logger.debug(f"   Тип choices: {type(response.choices)}")
@@ -222,38 +235,213 @@ class AIService:
             logger.debug(f"   Текст результата: {repr(result)}")
             logger.debug(f"   Длина текста: {len(result) if result else 0}")
             
-            # Проверяем причину завершения
-            if finish_reason == 'length':
-                return f"⚠️ Ответ был обрезан из-за лимита токенов. Попробуйте задать более короткий вопрос или очистите историю командой /reset."
+            # Обрезанный ответ отдаем с предупреждением, как в потоковом режиме
+            if finish_reason == 'length' and result:
+                return f"{result}\n\n{TRUNCATED_RESPONSE_MESSAGE}"
             
             return result
     
     async def get_response(
-        self, message: str, context: List[Dict[str, str]] = None, system_prompt: str = None
+        self, message: str, context: List[Dict[str, str]] = None,
+        system_prompt: Union[str, SystemPrompt, None] = None,
+        priority: int = PRIORITY_TEXT, hedge: bool = False
     ) -> str:
         # Получает ответ от выбранной модели ИИ через официальные API
         # message: Текст сообщения пользователя, context: Контекст предыдущей беседы
-        # system_prompt: Системный промпт для модели
+        # system_prompt: Системный промпт для модели, priority: приоритет в очереди допуска
+        # hedge: продублировать запрос запасной модели, если основная отвечает дольше p95
+        system_prompt = as_system_prompt(system_prompt)
+        _answered_by.set(self.model_name)
+        cache_key = self._get_cache_key(message, context, system_prompt)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached:
+                return cached
+        
+        started = time.monotonic()
+        response = await self._fetch_response(message, context, system_prompt, priority, hedge)
+        # Ответ запасной модели не кэшируем под ключом основной
+        if cache_key and is_cacheable(response) and _answered_by.get() == self.model_name:
+            await response_cache.set(cache_key, response, time.monotonic() - started)
+        return response
+    
+    async def _fetch_response(
+        self, message: str, context: Optional[List[Dict[str, str]]], system_prompt: Optional[SystemPrompt],
+        priority: int, hedge: bool = False
+    ) -> str:
+        hedge_service = self.get_hedge_service() if hedge else None
+        if hedge_service:
+            hedge_won, response = await self.hedger.race(
+                self._fetch_response(message, context, system_prompt, priority),
+                lambda: hedge_service._fetch_response(message, context, system_prompt, priority),
+                stream=False
+            )
+            if hedge_won:
+                _answered_by.set(hedge_service.model_name)
+            return response
+        
         messages = self._prepare_messages(message, context, system_prompt)
         # Для Claude передаем system_prompt отдельно, для OpenAI он уже в messages
         claude_system_prompt = system_prompt if self.is_claude_model() else None
-        return await self._make_api_call(messages, claude_system_prompt)
+        return await self._make_api_call(messages, claude_system_prompt, priority)
     
-    async def get_agent_response(self, agent_name: str, system_prompt: str, message: str) -> str:
-        """Получает ответ от агента (поддерживает OpenAI и Claude)"""
+    async def stream_response(
+        self, message: str, context: List[Dict[str, str]] = None,
+        system_prompt: Union[str, SystemPrompt, None] = None,
+        priority: int = PRIORITY_TEXT, hedge: bool = False
+    ) -> AsyncIterator[str]:
+        # Потоковый вариант get_response: отдает фрагменты текста по мере генерации
+        system_prompt = as_system_prompt(system_prompt)
+        _answered_by.set(self.model_name)
+        cache_key = self._get_cache_key(message, context, system_prompt)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached:
+                yield cached
+                return
+        
+        started = time.monotonic()
+        parts = []
+        async for delta in self._stream_uncached(message, context, system_prompt, priority, hedge):
+            parts.append(delta)
+            yield delta
+        
+        response = "".join(parts)
+        if cache_key and is_cacheable(response) and _answered_by.get() == self.model_name:
+            await response_cache.set(cache_key, response, time.monotonic() - started)
+    
+    async def _stream_uncached(
+        self, message: str, context: Optional[List[Dict[str, str]]], system_prompt: Optional[SystemPrompt],
+        priority: int, hedge: bool = False
+    ) -> AsyncIterator[str]:
+        hedge_service = self.get_hedge_service() if hedge else None
+        if hedge_service:
+            async for delta in self._hedged_stream(hedge_service, message, context, system_prompt, priority):
+                yield delta
+            return
+        
+        messages = self._prepare_messages(message, context, system_prompt)
+        claude_system_prompt = system_prompt if self.is_claude_model() else None
+        
+        received = False
+        async for delta in self._stream_api_call(messages, claude_system_prompt, priority):
+            if delta:
+                received = True
+                yield delta
+        
+        if not received:
+            logger.warning(f"🚨 ПУСТОЙ ПОТОКОВЫЙ ОТВЕТ ОТ НЕЙРОСЕТИ: {self.model_name}")
+            raise EmptyResponseError(self.provider, self.model_name)
+    
+    async def _hedged_stream(
+        self, hedge_service: "AIService", message: str, context: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[SystemPrompt], priority: int
+    ) -> AsyncIterator[str]:
+        # Гонка за первый токен: дубль запускается, если основная модель молчит дольше p95,
+        # дальше читаем только поток победителя
+        streams = {
+            False: self._stream_uncached(message, context, system_prompt, priority),
+            True: hedge_service._stream_uncached(message, context, system_prompt, priority),
+        }
+        
+        async def first_chunk(stream: AsyncIterator[str]) -> str:
+            return await stream.__anext__()
+        
         try:
-            # Создаем или получаем агента из кеша
-            agent = self.agent_service.create_agent(agent_name, system_prompt)
-            
-            # Получаем ответ от агента с передачей текущей модели
-            response = await self.agent_service.get_agent_response(agent, message, self.model_name)
-            
-            return response
-            
+            hedge_won, chunk = await self.hedger.race(
+                first_chunk(streams[False]), lambda: first_chunk(streams[True]), stream=True
+            )
+            if hedge_won:
+                _answered_by.set(hedge_service.model_name)
+            yield chunk
+            async for chunk in streams[hedge_won]:
+                yield chunk
+        finally:
+            for stream in streams.values():
+                await stream.aclose()
+    
+    async def _stream_api_call(
+        self, messages: List[Dict[str, str]], system_prompt: Optional[SystemPrompt] = None,
+        priority: int = PRIORITY_TEXT
+    ) -> AsyncIterator[str]:
+        # Потоковый API вызов к любому провайдеру
+        logger.info(f"📤 Отправляем потоковый запрос к нейросети: {self.model_name}, сообщений: {len(messages)}")
+        
+        if self.is_claude_model() and not self.anthropic_client:
+            raise ProviderRequestError(self.provider, self.model_name, ERROR_ANTHROPIC_KEY_MISSING)
+        
+        # Повторяется только открытие потока: после первых фрагментов повтор задублировал бы текст
+        if self.is_claude_model():
+            # Убираем системный промпт из сообщений для Claude
+            claude_messages = [msg for msg in messages if msg["role"] != "system"]
+            stream = await self._call_provider(lambda: self.anthropic_client.messages.create(
+                model=self.model_name,
+                max_tokens=MAX_TOKENS,
+                messages=mark_claude_history(claude_messages),
+                system=build_claude_system(system_prompt),
+                stream=True
+            ), priority, keep_slot=True)
+        else:
+            stream = await self._call_provider(lambda: self.openai_client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_completion_tokens=MAX_TOKENS,
+                stream=True
+            ), priority, keep_slot=True)
+        
+        # Слот занят до конца потока: генерация продолжается, пока читаем ответ
+        try:
+            async with stream:
+                async for delta in self._iter_stream_text(stream):
+                    yield delta
         except Exception as e:
-            logger.error(f"❌ Ошибка при работе с агентом {agent_name}: {e}")
-            # Fallback на обычный метод
-            return await self.get_response(message, system_prompt=system_prompt)
+            # Обрыв посреди ответа: учитываем сбой, но не повторяем
+            self.breaker.record(e)
+            raise self._request_error(e) from e
+        finally:
+            self.admission.release()
+        
+        logger.info(f"🤖 Потоковый ответ завершен: {self.model_name}")
+    
+    async def _iter_stream_text(self, stream) -> AsyncIterator[str]:
+        # Текстовые фрагменты из событий потока провайдера
+        if self.is_claude_model():
+            async for event in stream:
+                if event.type == "message_start":
+                    prompt_cache_usage.record(self.model_name, event.message.usage)
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    yield event.delta.text
+                # Сообщаем об обрезке ответа в конце потока
+                elif event.type == "message_delta" and event.delta.stop_reason == "max_tokens":
+                    yield f"\n\n{TRUNCATED_RESPONSE_MESSAGE}"
+        else:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    yield choice.delta.content
+                # Сообщаем об обрезке ответа в конце потока
+                if choice.finish_reason == 'length':
+                    yield f"\n\n{TRUNCATED_RESPONSE_MESSAGE}"
+    
+    async def get_agent_response(
+        self, agent_id: str, agent_name: str, system_prompt: Union[str, SystemPrompt], message: str,
+        context: List[Dict[str, str]] = None, priority: int = PRIORITY_TEXT
+    ) -> str:
+        """Получает ответ от агента (поддерживает OpenAI и Claude)"""
+        # Агент - это модель с собственным промптом: контекст, повторы и кэши те же, что в обычном режиме
+        logger.info(f"📤 Отправляем запрос агенту {agent_name} ({agent_id})")
+        return await self.get_response(message, context, system_prompt, priority)
+    
+    async def stream_agent_response(
+        self, agent_id: str, agent_name: str, system_prompt: Union[str, SystemPrompt], message: str,
+        context: List[Dict[str, str]] = None, priority: int = PRIORITY_TEXT
+    ) -> AsyncIterator[str]:
+        """Потоковый ответ агента"""
+        logger.info(f"📤 Отправляем запрос агенту {agent_name} ({agent_id})")
+        async for delta in self.stream_response(message, context, system_prompt, priority):
+            yield delta
     
     def _create_image_content(self, encoded_image: str) -> List[Dict]:
         # Создает контент сообщения с изображением для разных API
@@ -265,7 +453,7 @@ class AIService:
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
+                    "media_type": IMAGE_MEDIA_TYPE,
                     "data": encoded_image
                 }
             }]
@@ -275,16 +463,15 @@ class AIService:
                 "text": IMAGE_ANALYSIS_PROMPT
             }, {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}
+                "image_url": {"url": f"data:{IMAGE_MEDIA_TYPE};base64,{encoded_image}"}
             }]
     
     @error_handler
-    async def read_image(self, image_path: str) -> str:
+    async def read_image(self, image: bytes, priority: int = PRIORITY_IMAGE) -> str:
         # Анализирует изображение с помощью выбранной модели через официальные API
-        # image_path: Путь к файлу изображения
-        with open(image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+        # image: Байты изображения; уменьшаются до предела провайдера и кодируются один раз
+        encoded_image = await encode_image(image, self.provider)
         
         image_content = self._create_image_content(encoded_image)
         messages = self._prepare_messages(image_content)
-        return await self._make_api_call(messages)
\ No newline at end of file
+        return await self._make_api_call(messages, priority=priority)
\ No newline at end of file
@@ -0,0 +1,200 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiolimiter import AsyncLimiter
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from bot.services.outbound import PRIORITY_BROADCAST, outbound_priority
+from bot.utils.logger import setup_logger
+from config import (
+    BROADCAST_RATE_LIMIT, BROADCAST_WORKERS, BROADCAST_CHUNK_SIZE,
+    BROADCAST_REPORT_INTERVAL, BROADCAST_MAX_RETRIES
+)
+
+# ================================================
+# Логгер для рассылок
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Статусы рассылки
+# ================================================
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_SUPERSEDED = "superseded"  # Прервана и заменена новой рассылкой - не возобновляется
+
+ProgressCallback = Callable[[Dict], Awaitable[None]]
+
+
+class BroadcastService:
+    """Массовая рассылка с ограничением скорости и возобновлением после сбоя"""
+
+    def __init__(self, db):
+        self.db = db
+        self.broadcasts = db.db.broadcasts
+        self._task: Optional[asyncio.Task] = None
+        # Глобальная пауза для всех воркеров после TelegramRetryAfter
+        self._paused_until = 0.0
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, text: str, on_progress: ProgressCallback) -> ObjectId:
+        """Создает новую рассылку и запускает ее в фоне"""
+        # Прерванные рассылки больше не возобновить - иначе они навсегда остались бы "running"
+        superseded = await self.broadcasts.update_many(
+            {"status": STATUS_RUNNING},
+            {"$set": {"status": STATUS_SUPERSEDED, "finished_at": datetime.utcnow()}},
+        )
+        if superseded.modified_count:
+            logger.info(f"Прерванные рассылки закрыты новой: {superseded.modified_count}")
+        broadcast_id = (await self.broadcasts.insert_one({
+            "text": text,
+            "status": STATUS_RUNNING,
+            "last_user_id": None,
+            "sent": 0,
+            "failed": 0,
+            "created_at": datetime.utcnow(),
+        })).inserted_id
+        self._run_in_background(bot, broadcast_id, on_progress)
+        return broadcast_id
+
+    async def find_unfinished(self) -> List[Dict]:
+        """Незавершенные рассылки, от новых к старым"""
+        cursor = self.broadcasts.find(
+            {"status": STATUS_RUNNING}, {"text": 1, "sent": 1, "failed": 1, "created_at": 1}
+        ).sort("created_at", -1)
+        return await cursor.to_list(length=None)
+
+    async def resume(
+        self, bot: Bot, on_progress: ProgressCallback, broadcast_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        """Возобновляет незавершенную рассылку по id или последнюю"""
+        # Контрольная точка пишется после каждой пачки: пользователи прерванной пачки
+        # (до BROADCAST_CHUNK_SIZE) могут получить сообщение повторно
+        query = {"status": STATUS_RUNNING}
+        if broadcast_id is not None:
+            try:
+                query["_id"] = ObjectId(broadcast_id)
+            except InvalidId:
+                return None
+        broadcast = await self.broadcasts.find_one(query, sort=[("created_at", -1)])
+        if broadcast:
+            self._run_in_background(bot, broadcast["_id"], on_progress)
+        return broadcast
+
+    def _run_in_background(self, bot: Bot, broadcast_id: ObjectId, on_progress: ProgressCallback) -> None:
+        self._task = asyncio.create_task(self.run(bot, broadcast_id, on_progress))
+        self._task.add_done_callback(self._log_task_result)
+
+    @staticmethod
+    def _log_task_result(task: asyncio.Task) -> None:
+        # Рассылку можно возобновить с последней контрольной точки через /send_all_resume
+        if not task.cancelled() and task.exception():
+            logger.error(f"Рассылка прервана: {task.exception()}")
+
+    async def run(self, bot: Bot, broadcast_id: ObjectId, on_progress: ProgressCallback) -> Dict:
+        """Отправляет рассылку пачками, сохраняя прогресс после каждой пачки"""
+        broadcast = await self.broadcasts.find_one({"_id": broadcast_id})
+        limiter = AsyncLimiter(BROADCAST_RATE_LIMIT, 1)
+        workers = asyncio.Semaphore(BROADCAST_WORKERS)
+        started = time.monotonic()
+        sent_in_run = 0
+        last_report = started
+
+        # Потоково читаем только user_id, начиная после последнего обработанного
+        query = {}
+        if broadcast["last_user_id"] is not None:
+            query["user_id"] = {"$gt": broadcast["last_user_id"]}
+        cursor = self.db.users.find(
+            query, {"_id": 0, "user_id": 1}, batch_size=BROADCAST_CHUNK_SIZE
+        ).sort("user_id", 1)
+
+        chunk: List[int] = []
+        async for user in cursor:
+            chunk.append(user["user_id"])
+            if len(chunk) < BROADCAST_CHUNK_SIZE:
+                continue
+            sent_in_run += await self._process_chunk(bot, broadcast, chunk, limiter, workers)
+            chunk = []
+            if time.monotonic() - last_report >= BROADCAST_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                await self._report(on_progress, broadcast, sent_in_run, started, finished=False)
+
+        if chunk:
+            sent_in_run += await self._process_chunk(bot, broadcast, chunk, limiter, workers)
+
+        await self.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {"$set": {"status": STATUS_DONE, "finished_at": datetime.utcnow()}},
+        )
+        return await self._report(on_progress, broadcast, sent_in_run, started, finished=True)
+
+    async def _process_chunk(
+        self, bot: Bot, broadcast: Dict, chunk: List[int],
+        limiter: AsyncLimiter, workers: asyncio.Semaphore
+    ) -> int:
+        # Отправка пачки пулом воркеров и сохранение контрольной точки
+        async def send(user_id: int) -> bool:
+            async with workers:
+                return await self._send_with_retry(bot, user_id, broadcast["text"], limiter)
+
+        results = await asyncio.gather(*(send(user_id) for user_id in chunk))
+        sent = sum(results)
+        failed = len(results) - sent
+
+        broadcast["last_user_id"] = chunk[-1]
+        broadcast["sent"] += sent
+        broadcast["failed"] += failed
+        await self.broadcasts.update_one(
+            {"_id": broadcast["_id"]},
+            {"$set": {"last_user_id": chunk[-1]}, "$inc": {"sent": sent, "failed": failed}},
+        )
+        return len(results)
+
+    async def _send_with_retry(self, bot: Bot, user_id: int, text: str, limiter: AsyncLimiter) -> bool:
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            # Ждем окончания глобальной паузы после flood control
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with limiter:
+                try:
+                    # Рассылка уступает очередь ответам пользователям; TelegramRetryAfter
+                    # планировщик не повторяет, а передает сюда для общей паузы
+                    with outbound_priority(PRIORITY_BROADCAST):
+                        await bot.send_message(user_id, text)
+                    return True
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Flood control при рассылке, пауза {e.retry_after} с")
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                except TelegramForbiddenError:
+                    # Пользователь заблокировал бота - повтор не поможет
+                    return False
+                except Exception as e:
+                    logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {str(e)}")
+                    return False
+        return False
+
+    async def _report(
+        self, on_progress: ProgressCallback, broadcast: Dict, processed: int,
+        started: float, finished: bool
+    ) -> Dict:
+        elapsed = time.monotonic() - started
+        progress = {
+            "sent": broadcast["sent"],
+            "failed": broadcast["failed"],
+            "rate": processed / elapsed if elapsed else 0.0,
+            "elapsed": elapsed,
+            "finished": finished,
+        }
+        try:
+            await on_progress(progress)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить прогресс рассылки: {str(e)}")
+        return progress
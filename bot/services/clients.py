@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import anthropic
+import openai
+
+from bot.utils.logger import setup_logger
+from config import (
+    OPENAI_API_KEY, ANTHROPIC_API_KEY, ANTHROPIC_BASE_URL, PROVIDER_HTTP2, PROVIDER_MAX_CONNECTIONS,
+    PROVIDER_MAX_KEEPALIVE, PROVIDER_KEEPALIVE_EXPIRY, PROVIDER_TIMEOUT
+)
+
+# ================================================
+# Логгер для клиентов провайдеров
+# ================================================
+logger = setup_logger(__name__)
+
+
+def build_http_client(sdk):
+    """Пул keep-alive соединений (HTTP/2 при поддержке сервером) на HTTP-библиотеке самого SDK"""
+    # SDK проверяют тип http_client (anthropic 1.x принимает только свой httpx2),
+    # поэтому клиент и лимиты строим из классов, которые экспортирует SDK
+    limits = type(sdk.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections=PROVIDER_MAX_KEEPALIVE,
+        keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY,
+    )
+    return sdk.DefaultAsyncHttpxClient(
+        http2=PROVIDER_HTTP2, limits=limits, timeout=sdk.Timeout(PROVIDER_TIMEOUT, connect=10.0)
+    )
+
+
+class ProviderClients:
+    """Общие для всего процесса клиенты OpenAI и Anthropic, у каждого свой пул соединений"""
+
+    def __init__(self):
+        # Клиенты создаются при первом обращении, а не при импорте или создании AIService
+        self._http_clients: Dict[str, Any] = {}
+        self._openai: Optional[openai.AsyncOpenAI] = None
+        self._anthropic: Optional[anthropic.AsyncAnthropic] = None
+
+    @property
+    def openai(self) -> openai.AsyncOpenAI:
+        # Встроенные повторы SDK отключены: повторами управляет bot/services/resilience.py
+        if self._openai is None:
+            self._openai = openai.AsyncOpenAI(
+                api_key=OPENAI_API_KEY, http_client=self._get_http_client("OpenAI", openai), max_retries=0
+            )
+        return self._openai
+
+    @property
+    def anthropic(self) -> Optional[anthropic.AsyncAnthropic]:
+        if self._anthropic is None and ANTHROPIC_API_KEY:
+            self._anthropic = anthropic.AsyncAnthropic(
+                api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL,
+                http_client=self._get_http_client("Anthropic", anthropic), max_retries=0
+            )
+        return self._anthropic
+
+    def _get_http_client(self, name: str, sdk):
+        if name not in self._http_clients:
+            self._http_clients[name] = build_http_client(sdk)
+        return self._http_clients[name]
+
+    async def warm_up(self) -> None:
+        """Заранее открывает TLS-соединения с провайдерами до начала обработки сообщений"""
+        clients = [("OpenAI", self.openai), ("Anthropic", self.anthropic)]
+        await asyncio.gather(*(
+            self._warm_up_connection(name, client) for name, client in clients if client
+        ))
+
+    async def _warm_up_connection(self, name: str, client) -> None:
+        # Любой ответ сервера означает, что соединение установлено и осталось в пуле
+        started = time.monotonic()
+        try:
+            await self._http_clients[name].head(str(client.base_url))
+            logger.info(f"Соединение с {name} прогрето за {(time.monotonic() - started) * 1000:.0f} мс")
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть соединение с {name}: {str(e)}")
+
+    async def close(self) -> None:
+        """Закрывает пулы соединений"""
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
+        self._openai = None
+        self._anthropic = None
+
+
+# ================================================
+# Единый реестр клиентов провайдеров для процесса
+# ================================================
+provider_clients = ProviderClients()
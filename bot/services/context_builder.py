@@ -0,0 +1,60 @@
+from typing import Dict, List
+
+from config import (
+    MAX_TOKENS, MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW, CONTEXT_TOKEN_BUDGET
+)
+
+# ================================================
+# Константы оценки токенов
+# ================================================
+BYTES_PER_TOKEN = 4  # Для кириллицы (2 байта на символ) оценка получается с запасом
+MESSAGE_OVERHEAD_TOKENS = 4  # Служебные токены роли и разделителей на сообщение
+SAFETY_MARGIN_TOKENS = 256
+IMAGE_PLACEHOLDER = "[изображение]"
+
+
+def count_tokens(text: str) -> int:
+    # Быстрая локальная оценка количества токенов без загрузки словаря токенизатора
+    # Не кэшируется: оценка дешевле хэширования длинной строки, а размер хода хранится в истории
+    if not text:
+        return 0
+    return -(-len(text.encode("utf-8")) // BYTES_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_turn_tokens(entry: Dict) -> int:
+    # Размер хода диалога: берем сохраненное значение, иначе считаем
+    tokens = entry.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(entry.get("message") or IMAGE_PLACEHOLDER) + count_tokens(entry.get("response", ""))
+    return tokens
+
+
+def get_history_budget(model: str, system_prompt: str, message: str) -> int:
+    # Бюджет токенов истории: окно контекста модели минус ответ, системный промпт и сообщение
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    available = (
+        window - MAX_TOKENS - count_tokens(system_prompt or "") - count_tokens(message or "")
+        - SAFETY_MARGIN_TOKENS
+    )
+    return max(0, min(CONTEXT_TOKEN_BUDGET, available))
+
+
+def build_context(history: List[Dict], budget: int) -> List[Dict[str, str]]:
+    # Выбирает целые ходы диалога от новых к старым, пока они помещаются в бюджет
+    selected = []
+    used = 0
+    for entry in reversed(history):
+        response = (entry.get("response") or "").strip()
+        if not response:
+            continue
+        tokens = count_turn_tokens(entry)
+        if used + tokens > budget:
+            break
+        used += tokens
+        selected.append(entry)
+
+    context = []
+    for entry in reversed(selected):
+        context.append({"role": "user", "content": (entry.get("message") or "").strip() or IMAGE_PLACEHOLDER})
+        context.append({"role": "assistant", "content": entry["response"].strip()})
+    return context
@@ -0,0 +1,32 @@
+class AIServiceError(Exception):
+    """Базовая ошибка обращения к провайдеру ИИ"""
+
+    def __init__(self, provider: str, model: str, reason: str):
+        super().__init__(reason)
+        self.provider = provider
+        self.model = model
+
+
+class ProviderBusyError(AIServiceError):
+    """Провайдер перегружен: очередь допуска заполнена или ожидание слота истекло"""
+
+    def __init__(self, provider: str, model: str):
+        super().__init__(provider, model, f"Провайдер {provider} ({model}) перегружен")
+
+
+class ProviderUnavailableError(AIServiceError):
+    """Провайдер недоступен: автомат разомкнут после серии сбоев"""
+
+    def __init__(self, provider: str, model: str):
+        super().__init__(provider, model, f"Провайдер {provider} временно недоступен")
+
+
+class ProviderRequestError(AIServiceError):
+    """Запрос к провайдеру не удался (ошибка не повторяемая или попытки исчерпаны)"""
+
+
+class EmptyResponseError(ProviderRequestError):
+    """Провайдер ответил, но без текста"""
+
+    def __init__(self, provider: str, model: str):
+        super().__init__(provider, model, f"Провайдер {provider} ({model}) вернул пустой ответ")
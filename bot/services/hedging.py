@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from bot.utils.logger import setup_logger
+from config import HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES
+
+# ================================================
+# Логгер для хеджирования запросов
+# ================================================
+logger = setup_logger(__name__)
+
+LATENCY_SAMPLES = 500  # Сколько последних задержек хранить для перцентиля
+
+
+class HedgeController:
+    """Дублирование медленного запроса на вторую модель: побеждает первый ответ"""
+
+    def __init__(self, model: str):
+        self.model = model
+        # Отдельные выборки для времени до первого токена (поток) и до полного ответа
+        self._latencies: Dict[bool, Deque[float]] = {
+            True: deque(maxlen=LATENCY_SAMPLES),
+            False: deque(maxlen=LATENCY_SAMPLES),
+        }
+        self.requests = 0
+        self.fired = 0
+        self.hedge_wins = 0
+
+    def get_delay(self, stream: bool) -> float:
+        """Через сколько секунд без ответа основной модели отправлять дубль"""
+        samples = sorted(self._latencies[stream])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+        return max(HEDGE_MIN_DELAY, samples[index])
+
+    async def race(
+        self, primary: Awaitable[Any], start_hedge: Callable[[], Awaitable[Any]], stream: bool
+    ) -> Tuple[bool, Any]:
+        """Возвращает (победил ли дубль, результат); проигравший запрос отменяется"""
+        self.requests += 1
+        started = time.monotonic()
+        primary_task = asyncio.ensure_future(primary)
+        tasks = {primary_task: False}
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.get_delay(stream))
+            if primary_task in done:
+                if not primary_task.exception():
+                    self._latencies[stream].append(time.monotonic() - started)
+                return False, primary_task.result()
+
+            self.fired += 1
+            tasks[asyncio.ensure_future(start_hedge())] = True
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                errors = {task: task.exception() for task in done}
+                # При одновременном завершении предпочитаем основную модель
+                for task in sorted(done, key=tasks.get):
+                    if errors[task] is None:
+                        is_hedge = tasks[task]
+                        # Если победил дубль, задержка основной модели не меньше прошедшего времени
+                        self._latencies[stream].append(time.monotonic() - started)
+                        if is_hedge:
+                            self.hedge_wins += 1
+                            logger.info(f"Дубль запроса победил основную модель {self.model}")
+                        return is_hedge, task.result()
+            # Обе модели не ответили - поднимаем ошибку основной
+            return False, primary_task.result()
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "fired": self.fired,
+            "hedge_wins": self.hedge_wins,
+            "fired_pct": round(self.fired * 100 / self.requests) if self.requests else 0,
+            "stream_delay_ms": round(self.get_delay(True) * 1000),
+            "delay_ms": round(self.get_delay(False) * 1000),
+        }
+
+
+# ================================================
+# Контроллеры хеджирования по основной модели
+# ================================================
+_controllers: Dict[str, HedgeController] = {}
+
+
+def get_hedge_controller(model: str) -> HedgeController:
+    if model not in _controllers:
+        _controllers[model] = HedgeController(model)
+    return _controllers[model]
+
+
+def get_hedge_stats() -> Dict[str, Dict[str, int]]:
+    return {model: controller.stats() for model, controller in _controllers.items() if controller.requests}
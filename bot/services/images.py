@@ -0,0 +1,98 @@
+import asyncio
+import base64
+from io import BytesIO
+from typing import Dict, Optional, Sequence, Tuple
+
+from cachetools import TTLCache
+from PIL import Image
+
+from config import IMAGE_JPEG_QUALITY, IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL
+
+# ================================================
+# Предельное разрешение изображений у провайдеров: (длинная сторона, короткая сторона)
+# Больше провайдер все равно уменьшит на своей стороне, поэтому лишние пиксели не отправляем
+# ================================================
+IMAGE_LIMITS = {
+    "openai": (2048, 768),
+    "anthropic": (1568, 1568),
+}
+IMAGE_MEDIA_TYPE = "image/jpeg"
+
+
+def get_target_size(width: int, height: int, provider: str) -> Tuple[int, int]:
+    # Размер после уменьшения до предела провайдера с сохранением пропорций
+    max_long, max_short = IMAGE_LIMITS[provider]
+    scale = min(1.0, max_long / max(width, height), max_short / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def pick_photo_size(sizes: Sequence, provider: str):
+    """Наименьший вариант фото из Telegram, которого хватает провайдеру (меньше скачивать)"""
+    max_long, max_short = IMAGE_LIMITS[provider]
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= max_long or min(size.width, size.height) >= max_short:
+            return size
+    return ordered[-1]
+
+
+def prepare_image(data: bytes, provider: str) -> bytes:
+    """Уменьшает и пережимает изображение в JPEG (CPU-нагрузка - вызывать в потоке)"""
+    with Image.open(BytesIO(data)) as image:
+        size = get_target_size(*image.size, provider)
+        if size == image.size and image.format == "JPEG":
+            return data
+        converted = image.convert("RGB") if image.mode != "RGB" else image
+        if size != converted.size:
+            converted = converted.resize(size, Image.Resampling.LANCZOS)
+        output = BytesIO()
+        converted.save(output, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+async def encode_image(data: bytes, provider: str) -> str:
+    """Готовит изображение к отправке и кодирует в base64 вне цикла событий"""
+    def encode() -> str:
+        return base64.b64encode(prepare_image(data, provider)).decode("ascii")
+    return await asyncio.to_thread(encode)
+
+
+class ImageAnalysisCache:
+    """Результаты анализа изображений по (file_unique_id, модель, промпт)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # Значение: {"response": ответ модели, "size": размер файла в байтах}
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get(self, file_unique_id: str, model: str, prompt: str) -> Optional[str]:
+        """Возвращает готовый ответ, если это фото уже анализировалось"""
+        entry = self._entries.get((file_unique_id, model, prompt))
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += entry["size"]
+        return entry["response"]
+
+    def store(self, file_unique_id: str, model: str, prompt: str, response: str, size: int) -> None:
+        self._entries[(file_unique_id, model, prompt)] = {"response": response, "size": size}
+
+    def stats(self) -> Dict[str, int]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": int(self._entries.maxsize),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio_pct": round(self.hits * 100 / total) if total else 0,
+            "download_kb_saved": self.bytes_saved // 1024,
+        }
+
+
+# ================================================
+# Единый кэш анализа изображений для процесса
+# ================================================
+image_cache = ImageAnalysisCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL)
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+
+from bot.utils.logger import setup_logger
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES, TELEGRAM_CHAT_ACTION_TTL
+)
+
+# ================================================
+# Логгер для исходящих запросов к Telegram
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Классы приоритета исходящих запросов (меньше - раньше)
+# ================================================
+PRIORITY_REPLY = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_BROADCAST = 2
+PRIORITY_NAMES = {PRIORITY_REPLY: "reply", PRIORITY_NOTIFICATION: "notification", PRIORITY_BROADCAST: "broadcast"}
+WAIT_SAMPLES = 500  # Сколько последних ожиданий хранить для перцентилей
+TRACKED_CHATS = 10000  # Сколько чатов держать в памяти для ограничителей и действий
+
+# Приоритет задается вызывающим кодом: по умолчанию все запросы - ответы пользователям
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_REPLY)
+
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """Понижает приоритет запросов к Telegram внутри блока (рассылки, уведомления)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class PriorityTokenBucket:
+    """Глобальный token bucket: освободившиеся токены получает самый приоритетный ожидающий"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # Куча (приоритет, порядок поступления, future); отмененные записи удаляются лениво
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен успели выдать в момент отмены - возвращаем его
+                self._tokens += 1
+                self._schedule()
+            raise
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._tokens -= 1
+                future.set_result(None)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._waiters and self._timer is None:
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Планировщик всех запросов бота к Telegram: лимиты, приоритеты, повторы после flood control"""
+
+    def __init__(self):
+        self.bucket = PriorityTokenBucket(TELEGRAM_GLOBAL_RATE, max(1, int(TELEGRAM_GLOBAL_RATE)))
+        # Ограничители чатов и последние действия живут, пока чат активен
+        self._chat_limiters: TTLCache = TTLCache(maxsize=TRACKED_CHATS, ttl=60)
+        self._chat_actions: TTLCache = TTLCache(maxsize=TRACKED_CHATS, ttl=TELEGRAM_CHAT_ACTION_TTL)
+        self._waits: Dict[int, Deque[float]] = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def __call__(
+        self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        # Служебные запросы (getUpdates, getMe, ответы на callback) идут без очереди
+        if chat_id is None and not method.__api_method__.startswith(("send", "edit", "delete")):
+            return await make_request(bot, method)
+
+        if isinstance(method, SendChatAction):
+            # Действие отображается несколько секунд - повторное в этом окне не нужно
+            key = (chat_id, method.action)
+            if key in self._chat_actions:
+                self.coalesced += 1
+                return Response[bool](ok=True, result=True)
+            self._chat_actions[key] = True
+
+        priority = _priority.get()
+        # Рассылка сама ставит на паузу всех своих воркеров после flood control - повторы только для остальных
+        max_retries = 0 if priority == PRIORITY_BROADCAST else TELEGRAM_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            await self._acquire(chat_id, priority, chat_limited=not isinstance(method, SendChatAction))
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                self.retried += 1
+                logger.warning(f"Flood control для {method.__api_method__} в чате {chat_id}, пауза {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+
+    async def _acquire(self, chat_id, priority: int, chat_limited: bool) -> None:
+        # Сначала лимит чата, затем глобальный: ожидание одного чата не держит общие токены
+        started = time.monotonic()
+        if chat_id is not None and chat_limited:
+            await self._get_chat_limiter(chat_id).acquire()
+        await self.bucket.acquire(priority)
+        self.requests += 1
+        self._waits.setdefault(priority, deque(maxlen=WAIT_SAMPLES)).append(time.monotonic() - started)
+
+    def _get_chat_limiter(self, chat_id) -> AsyncLimiter:
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            # Группы и каналы (отрицательный id или @username) ограничены строже личных чатов
+            if isinstance(chat_id, str) or chat_id < 0:
+                limiter = AsyncLimiter(TELEGRAM_GROUP_RATE, 60)
+            else:
+                limiter = AsyncLimiter(TELEGRAM_CHAT_BURST, TELEGRAM_CHAT_BURST / TELEGRAM_CHAT_RATE)
+        # Повторная запись продлевает жизнь ограничителя активного чата
+        self._chat_limiters[chat_id] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики запросов и задержка в очереди по классам приоритета"""
+        stats = {
+            "requests": self.requests,
+            "queued": self.bucket.queued,
+            "coalesced_actions": self.coalesced,
+            "retry_after": self.retried,
+        }
+        for priority, samples in sorted(self._waits.items()):
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            waits = sorted(samples)
+            stats[f"{name}_wait_avg_ms"] = round(sum(waits) * 1000 / len(waits))
+            stats[f"{name}_wait_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000)
+            stats[f"{name}_wait_max_ms"] = round(waits[-1] * 1000)
+        return stats
+
+
+# ================================================
+# Единый планировщик для сессии бота
+# ================================================
+outbound_scheduler = OutboundScheduler()
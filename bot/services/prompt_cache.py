@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from bot.utils.logger import setup_logger
+from config import ANTHROPIC_PROMPT_CACHE
+
+# ================================================
+# Логгер для кэширования промптов
+# ================================================
+logger = setup_logger(__name__)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    """Системный промпт: стабильная часть кэшируется провайдером, переменная идет после нее"""
+    static: str
+    dynamic: str = ""
+
+    @property
+    def text(self) -> str:
+        # Промпт одной строкой для OpenAI, ключей кэша и оценки токенов
+        return "\n\n".join(part.strip() for part in (self.static, self.dynamic) if part and part.strip())
+
+
+def as_system_prompt(value: Union[str, SystemPrompt, None]) -> Optional[SystemPrompt]:
+    # Обычная строка целиком считается стабильной частью
+    if value is None or isinstance(value, SystemPrompt):
+        return value
+    return SystemPrompt(static=value)
+
+
+def build_claude_system(prompt: Optional[SystemPrompt]) -> Union[str, List[Dict]]:
+    """Системный промпт Claude блоками: стабильный блок с cache_control, затем переменный"""
+    if prompt is None:
+        return ""
+    if not ANTHROPIC_PROMPT_CACHE:
+        return prompt.text
+    blocks = []
+    if prompt.static.strip():
+        blocks.append({"type": "text", "text": prompt.static.strip(), "cache_control": CACHE_CONTROL})
+    if prompt.dynamic.strip():
+        blocks.append({"type": "text", "text": prompt.dynamic.strip()})
+    return blocks
+
+
+def mark_claude_history(messages: List[Dict]) -> List[Dict]:
+    """Точка кэширования на последнем ходе истории: префикс диалога переиспользуется в следующем запросе"""
+    if not ANTHROPIC_PROMPT_CACHE or len(messages) < 2:
+        return messages
+    last = messages[-2]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [*content[:-1], {**content[-1], "cache_control": CACHE_CONTROL}]
+    return [*messages[:-2], {**last, "content": content}, messages[-1]]
+
+
+class PromptCacheUsage:
+    """Счетчики токенов, прочитанных из кэша промптов и записанных в него"""
+
+    def __init__(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+
+    def record(self, model: str, usage) -> None:
+        if usage is None:
+            return
+        read = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.requests += 1
+        self.input_tokens += getattr(usage, "input_tokens", None) or 0
+        self.cache_read_tokens += read
+        self.cache_write_tokens += written
+        logger.debug(f"   Кэш промпта {model}: прочитано {read}, записано {written} токенов")
+
+    def stats(self) -> Dict[str, int]:
+        total = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        return {
+            "requests": self.requests,
+            "input_tokens": self.input_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cached_pct": round(self.cache_read_tokens * 100 / total) if total else 0,
+        }
+
+
+# ================================================
+# Учет кэша промптов Anthropic для всего процесса
+# ================================================
+prompt_cache_usage = PromptCacheUsage()
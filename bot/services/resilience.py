@@ -0,0 +1,146 @@
+import time
+from typing import Dict, Optional
+
+import anthropic
+import httpx
+import openai
+from tenacity import (
+    AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, stop_before_delay,
+    wait_random_exponential
+)
+
+from bot.services.errors import ProviderUnavailableError
+from bot.utils.logger import setup_logger
+from config import (
+    PROVIDER_MAX_RETRIES, PROVIDER_RETRY_DEADLINE, PROVIDER_RETRY_BASE_DELAY,
+    PROVIDER_RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_TIMEOUT
+)
+
+# ================================================
+# Логгер для повторов и автомата отключения
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Ошибки провайдеров, после которых имеет смысл повторить запрос
+# ================================================
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+CONNECTION_ERRORS = (openai.APIConnectionError, anthropic.APIConnectionError, httpx.TransportError)
+STATUS_ERRORS = (openai.APIStatusError, anthropic.APIStatusError)
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Таймауты, обрывы соединения, 429 и 5xx - временные сбои на стороне провайдера
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    if isinstance(error, STATUS_ERRORS):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def get_retry_after(error: Optional[BaseException]) -> Optional[float]:
+    # Пауза, которую просит провайдер в заголовке Retry-After (в секундах)
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+_backoff = wait_random_exponential(multiplier=PROVIDER_RETRY_BASE_DELAY, max=PROVIDER_RETRY_MAX_DELAY)
+
+
+def wait_before_retry(retry_state: RetryCallState) -> float:
+    # Экспоненциальная пауза со случайным разбросом, но не меньше Retry-After
+    delay = _backoff(retry_state)
+    retry_after = get_retry_after(retry_state.outcome.exception())
+    return max(delay, min(retry_after, PROVIDER_RETRY_MAX_DELAY)) if retry_after else delay
+
+
+def log_retry(retry_state: RetryCallState) -> None:
+    error = retry_state.outcome.exception()
+    logger.warning(
+        f"Повтор запроса к провайдеру (попытка {retry_state.attempt_number}), "
+        f"пауза {retry_state.next_action.sleep:.1f} с: {type(error).__name__}: {str(error)}"
+    )
+
+
+def build_retrying() -> AsyncRetrying:
+    """Политика повторов: ограничена числом попыток и общим бюджетом времени"""
+    return AsyncRetrying(
+        retry=retry_if_exception(is_retryable),
+        stop=stop_after_attempt(PROVIDER_MAX_RETRIES + 1) | stop_before_delay(PROVIDER_RETRY_DEADLINE),
+        wait=wait_before_retry,
+        before_sleep=log_retry,
+        reraise=True,
+    )
+
+
+class CircuitBreaker:
+    """Автомат отключения провайдера: после серии сбоев запросы сразу отклоняются"""
+
+    def __init__(self, provider: str, failure_threshold: int, recovery_timeout: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.failure_threshold
+
+    def check(self, model: str) -> None:
+        """Пропускает запрос, если автомат замкнут или пора сделать пробный запрос"""
+        if not self.is_open:
+            return
+        now = time.monotonic()
+        if now < self._open_until:
+            self.rejected += 1
+            raise ProviderUnavailableError(self.provider, model)
+        # Полуоткрытое состояние: пропускаем один пробный запрос, остальные ждут его результата
+        self._open_until = now + self.recovery_timeout
+
+    def record(self, error: Optional[BaseException]) -> None:
+        """Учитывает результат запроса; сбоями считаются только ошибки на стороне провайдера"""
+        if error is None:
+            self.failures = 0
+            return
+        if not is_retryable(error):
+            # Ошибки запроса (400, отказ по политике) не говорят о здоровье провайдера - счетчик не меняется
+            return
+        self.failures += 1
+        if not self.is_open:
+            return
+        if self.failures == self.failure_threshold:
+            self.opened += 1
+            logger.error(f"Провайдер {self.provider} отключен на {self.recovery_timeout:.0f} с после {self.failures} сбоев подряд")
+        # Размыкаем (или снова размыкаем после неудачного пробного запроса)
+        self._open_until = time.monotonic() + self.recovery_timeout
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "open": int(self.is_open and time.monotonic() < self._open_until),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+# ================================================
+# Автоматы отключения по провайдерам
+# ================================================
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_TIMEOUT)
+    return _breakers[provider]
+
+
+def get_circuit_stats() -> Dict[str, Dict[str, int]]:
+    return {provider: breaker.stats() for provider, breaker in _breakers.items()}
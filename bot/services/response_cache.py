@@ -0,0 +1,148 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from cachetools import TTLCache
+
+from bot.utils.logger import setup_logger
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+
+# ================================================
+# Логгер для кэша ответов
+# ================================================
+logger = setup_logger(__name__)
+
+MONGO_TRIM_EVERY = 100  # Проверять размер коллекции раз в столько записей
+
+
+def normalize_message(text: str) -> str:
+    # Регистр и пробелы не влияют на ответ: "Привет " и "привет" - один ключ
+    return " ".join((text or "").casefold().split())
+
+
+def make_cache_key(
+    model: str, system_prompt: Optional[str], context: Optional[List[Dict[str, str]]], message: str
+) -> str:
+    """Хэш модели, системного промпта, контекста диалога и нормализованного сообщения"""
+    fingerprint = [(item.get("role"), item.get("content")) for item in context or []]
+    payload = json.dumps(
+        [model, (system_prompt or "").strip(), fingerprint, normalize_message(message)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryResponseBackend:
+    """Кэш ответов в памяти процесса (TTL + LRU)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, entry: Dict) -> None:
+        self._entries[key] = entry
+
+    async def size(self) -> int:
+        return len(self._entries)
+
+
+class MongoResponseBackend:
+    """Кэш ответов в MongoDB: общий для нескольких процессов бота"""
+
+    def __init__(self, collection, maxsize: int, ttl: float):
+        # Устаревшие записи удаляет TTL-индекс по expires_at (см. Database.create_indexes)
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._writes = 0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        # TTL-индекс чистит коллекцию раз в минуту, поэтому срок проверяем и в запросе
+        return await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+
+    async def set(self, key: str, entry: Dict) -> None:
+        now = datetime.utcnow()
+        await self.collection.replace_one(
+            {"_id": key},
+            {**entry, "created_at": now, "expires_at": now + timedelta(seconds=self.ttl)},
+            upsert=True,
+        )
+        self._writes += 1
+        if self._writes % MONGO_TRIM_EVERY == 0:
+            await self._trim()
+
+    async def _trim(self) -> None:
+        # Ограничение размера: удаляем самые старые записи сверх лимита
+        overflow = await self.collection.estimated_document_count() - self.maxsize
+        if overflow <= 0:
+            return
+        cursor = self.collection.find({}, {"_id": 1}).sort("created_at", 1).limit(overflow)
+        keys = [doc["_id"] async for doc in cursor]
+        await self.collection.delete_many({"_id": {"$in": keys}})
+
+    async def size(self) -> int:
+        return await self.collection.estimated_document_count()
+
+
+class ResponseCache:
+    """Кэш ответов нейросети на повторяющиеся запросы (выключен, пока не задан backend)"""
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def configure(self, backend) -> None:
+        self.backend = backend
+
+    async def get(self, key: str) -> Optional[str]:
+        """Возвращает закэшированный ответ; сбой кэша не мешает запросу к провайдеру"""
+        try:
+            entry = await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша ответов: {str(e)}")
+            return None
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_latency += entry.get("latency", 0.0)
+        return entry["response"]
+
+    async def set(self, key: str, response: str, latency: float) -> None:
+        """Сохраняет ответ вместе с временем, которое занял запрос к провайдеру"""
+        try:
+            await self.backend.set(key, {"response": response, "latency": latency})
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш ответов: {str(e)}")
+
+    async def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": await self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio_pct": round(self.hits * 100 / total) if total else 0,
+            "saved_latency_s": round(self.saved_latency, 1),
+        }
+
+
+def create_response_backend(db):
+    """Backend кэша ответов по настройке RESPONSE_CACHE_BACKEND"""
+    if RESPONSE_CACHE_BACKEND == "mongo":
+        return MongoResponseBackend(db.response_cache, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return MemoryResponseBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+# ================================================
+# Единый кэш ответов для всех сервисов моделей
+# ================================================
+response_cache = ResponseCache()
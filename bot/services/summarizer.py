@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from bot.services.admission import PRIORITY_BACKGROUND
+from bot.services.ai_service import AIService
+from bot.services.prompt_cache import SystemPrompt
+from bot.utils.logger import setup_logger
+from config import SUMMARY_MODEL, SUMMARY_TRIGGER_TURNS, SUMMARY_KEEP_RECENT_TURNS
+
+# ================================================
+# Логгер для сводок диалогов
+# ================================================
+logger = setup_logger(__name__)
+
+# ================================================
+# Промпты для построения сводки
+# ================================================
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Keep facts, decisions, user preferences and open questions. Be concise, no more than "
+    "200 words. Write the summary in the language of the conversation."
+)
+SUMMARY_CONTEXT_HEADER = "Краткое содержание предыдущей части диалога:"
+
+
+def format_summary_request(previous_summary: Optional[str], turns: list) -> str:
+    # Текст запроса: прошлая сводка + новые ходы, которые нужно в нее добавить
+    lines = []
+    if previous_summary:
+        lines.append(f"Current summary:\n{previous_summary}\n")
+    lines.append("New conversation turns:")
+    for turn in turns:
+        lines.append(f"User: {turn.get('message') or '[image]'}")
+        lines.append(f"Assistant: {turn.get('response', '')}")
+    lines.append("\nReturn the updated summary only.")
+    return "\n".join(lines)
+
+
+def append_summary(system_prompt: str, summary: Optional[Dict]) -> SystemPrompt:
+    # Добавляет сводку ранних ходов к системному промпту
+    # Сводка меняется, поэтому идет после стабильной (кэшируемой провайдером) части
+    if not summary or not summary.get("summary"):
+        return SystemPrompt(system_prompt)
+    return SystemPrompt(system_prompt, f"{SUMMARY_CONTEXT_HEADER}\n{summary['summary']}")
+
+
+class ConversationSummarizer:
+    """Фоновое сворачивание ранних ходов длинных диалогов в сводку"""
+
+    def __init__(self, db):
+        self.db = db
+        self.service = AIService(model_name=SUMMARY_MODEL)
+        self._in_progress: Set[Tuple[int, Optional[str]]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, user_id: int, agent_id: Optional[str]) -> None:
+        """Запускает обновление сводки в фоне, не задерживая ответ пользователю"""
+        key = (user_id, agent_id)
+        if key in self._in_progress:
+            return
+        self._in_progress.add(key)
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Tuple[int, Optional[str]]) -> None:
+        try:
+            await self.summarize(*key)
+        except Exception as e:
+            logger.error(f"Ошибка обновления сводки диалога {key}: {str(e)}")
+        finally:
+            self._in_progress.discard(key)
+
+    async def summarize(self, user_id: int, agent_id: Optional[str]) -> bool:
+        """Сворачивает старые ходы в сводку, если несвернутых ходов больше порога"""
+        manager = await self.db.get_user_manager()
+        summary = await manager.get_summary(user_id, agent_id)
+        summarized_until = summary["summarized_until"] if summary else None
+
+        pending = await manager.count_history(user_id, agent_id, after=summarized_until)
+        if pending <= SUMMARY_TRIGGER_TURNS:
+            return False
+
+        # Сворачиваем самые ранние ходы, оставляя последние нетронутыми
+        # limit(0) в Mongo означает "без ограничения" - пустой набор проверяем заранее
+        count = pending - SUMMARY_KEEP_RECENT_TURNS
+        if count <= 0:
+            return False
+        turns = await manager.get_history(
+            user_id, agent_id, count, after=summarized_until, oldest_first=True
+        )
+        if not turns:
+            return False
+
+        request = format_summary_request(summary["summary"] if summary else None, turns)
+        new_summary = await self.service.get_response(
+            request, system_prompt=SUMMARY_SYSTEM_PROMPT, priority=PRIORITY_BACKGROUND
+        )
+        # Сбои провайдера и пустые ответы поднимаются как AIServiceError и логируются в _run
+        if not new_summary:
+            logger.warning(f"Сводка диалога {user_id}/{agent_id} не обновлена: {new_summary}")
+            return False
+
+        await manager.save_summary(user_id, agent_id, new_summary.strip(), turns[-1]["timestamp"])
+        logger.info(f"Сводка диалога {user_id}/{agent_id} обновлена: свернуто {len(turns)} ходов")
+        return True
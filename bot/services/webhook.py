@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.utils.logger import setup_logger
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONNECTIONS
+)
+
+# ================================================
+# Логгер для приема обновлений
+# ================================================
+logger = setup_logger(__name__)
+
+
+class UpdateConcurrencyMiddleware(BaseMiddleware):
+    """Ограничивает число обновлений, обрабатываемых одновременно"""
+
+    def __init__(self, limit: int):
+        # Webhook и polling создают задачу на каждое обновление - всплеск не должен исчерпать ресурсы
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject, data: Dict[str, Any]
+    ) -> Any:
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """aiohttp-приложение, принимающее обновления от Telegram"""
+    app = web.Application()
+    # Запросы без верного секретного заголовка отклоняются до разбора обновления
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Запускает HTTP-сервер и регистрирует webhook в Telegram"""
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required when BOT_MODE=webhook")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set, webhook requests are not verified")
+
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    try:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+        logger.info(f"Bot started in webhook mode on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -1,6 +1,8 @@
+import time
 from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 
-from config import DAILY_TOKENS
+from config import DAILY_TOKENS, DAILY_REWARDS_BATCH_SIZE
 from bot.utils.logger import setup_logger
 
 # ================================================
@@ -9,47 +11,119 @@ from bot.utils.logger import setup_logger
 logger = setup_logger(__name__)
 
 
-async def daily_rewards_task(bot, db):
-    """Начисляет ежедневные токены всем пользователям, сбрасывая баланс"""
+def get_reward_threshold(now: datetime) -> datetime:
+    # Токены положены тем, кто получал их раньше начала вчерашнего дня
     # Текущая дата, сброшенная до начала дня
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    yesterday = today - timedelta(days=1)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=1)
+
 
-    # Получаем всех пользователей, которым нужно начислить токены
-    query = {
+def build_daily_rewards_query(now: datetime) -> dict:
+    # Фильтр пользователей, которым нужно начислить токены
+    return {
         "$or": [
-            {"last_daily_reward": {"$lt": yesterday}},
+            {"last_daily_reward": {"$lt": get_reward_threshold(now)}},
             {"last_daily_reward": {"$exists": False}},
         ],
     }
 
-    users = await db.users.find(query).to_list(length=None)
+
+def build_reward_due_expression(now: datetime) -> dict:
+    # То же условие, что build_daily_rewards_query, но в виде выражения агрегации
+    # $lt в запросе сравнивает только даты, а null не считается отсутствующим полем
+    field_type = {"$type": "$last_daily_reward"}
+    return {
+        "$or": [
+            {"$eq": [field_type, "missing"]},
+            {"$and": [
+                {"$eq": [field_type, "date"]},
+                {"$lt": ["$last_daily_reward", get_reward_threshold(now)]},
+            ]},
+        ]
+    }
+
+
+def is_reward_due(user_data: dict, now: datetime) -> bool:
+    # Проверка того же условия в Python для уже загруженного документа
+    if "last_daily_reward" not in user_data:
+        return True
+    last_reward = user_data["last_daily_reward"]
+    return isinstance(last_reward, datetime) and last_reward < get_reward_threshold(now)
+
+
+def build_lazy_reserve(now: datetime, tokens_cost: int) -> Tuple[dict, list]:
+    # Условие и pipeline-обновление для резерва с ленивым ежедневным начислением
+    # Если начисление положено - баланс сначала сбрасывается до DAILY_TOKENS в той же операции
+    condition = [{"balance": {"$gte": tokens_cost}}]
+    if DAILY_TOKENS >= tokens_cost:
+        condition.extend(build_daily_rewards_query(now)["$or"])
+
+    due = build_reward_due_expression(now)
+    update = [{
+        "$set": {
+            "balance": {"$subtract": [{"$cond": [due, DAILY_TOKENS, "$balance"]}, tokens_cost]},
+            "last_daily_reward": {"$cond": [due, now, "$last_daily_reward"]},
+        }
+    }]
+    return {"$or": condition}, update
+
+
+async def apply_rewards_batch(db, query: dict, update: dict, ids: Optional[List] = None) -> Tuple[int, int]:
+    # Одна серверная операция update_many на всю выборку или на пачку _id
+    batch_query = {**query, "_id": {"$in": ids}} if ids is not None else query
+    started = time.monotonic()
+    try:
+        result = await db.users.update_many(batch_query, update)
+        success, failed = result.modified_count, 0
+    except Exception as e:
+        logger.error(f"Ошибка при начислении токенов пачке пользователей: {str(e)}")
+        success, failed = 0, len(ids) if ids is not None else 0
+
+    logger.info(
+        f"Ежедневные токены: пачка {len(ids) if ids is not None else 'все'}, "
+        f"начислено {success}, ошибок {failed}, {(time.monotonic() - started) * 1000:.0f} мс"
+    )
+    return success, failed
+
+
+async def daily_rewards_task(bot, db, batch_size: int = DAILY_REWARDS_BATCH_SIZE):
+    """Начисляет ежедневные токены всем пользователям, сбрасывая баланс"""
+    started = time.monotonic()
+    now = datetime.now()
+
+    # Пользователи, которым нужно начислить токены
+    query = build_daily_rewards_query(now)
+    # Сбрасываем баланс и устанавливаем DAILY_TOKENS, обновляем время
+    update = {"$set": {"balance": DAILY_TOKENS, "last_daily_reward": now}}
 
     success_count = 0
     failed_count = 0
 
-    for user in users:
-        try:
-            # Сбрасываем баланс и устанавливаем DAILY_TOKENS, обновляем время
-            await db.users.update_one(
-                {"user_id": user["user_id"]},
-                {
-                    "$set": {
-                        "balance": DAILY_TOKENS,  # Устанавливаем фиксированное значение
-                        "last_daily_reward": datetime.now(),
-                    },
-                },
-            )
-            success_count += 1
-
-        except Exception as e:
-            logger.error(
-                f"Ошибка при начислении токенов пользователю {user['user_id']}: {str(e)}"
-            )
-            failed_count += 1
+    if batch_size <= 0:
+        # Без пачек - одна операция update_many на сервере
+        success_count, failed_count = await apply_rewards_batch(db, query, update)
+    else:
+        # Потоково читаем только _id и обновляем пачками, не загружая пользователей в память
+        cursor = db.users.find(query, {"_id": 1}, batch_size=batch_size)
+        ids = []
+        async for user in cursor:
+            ids.append(user["_id"])
+            if len(ids) >= batch_size:
+                success, failed = await apply_rewards_batch(db, query, update, ids)
+                success_count += success
+                failed_count += failed
+                ids = []
+        if ids:
+            success, failed = await apply_rewards_batch(db, query, update, ids)
+            success_count += success
+            failed_count += failed
+
+    # Балансы изменены в обход UserManager - сбрасываем кэш пользователей
+    db.user_manager.cache.clear()
 
     logger.info(
-        f"Ежедневные токены: начислено {success_count} пользователям, не удалось {failed_count}"
+        f"Ежедневные токены: начислено {success_count} пользователям, не удалось {failed_count} "
+        f"за {time.monotonic() - started:.1f} с"
     )
 
     return success_count, failed_count
@@ -0,0 +1,265 @@
+import re
+from html import escape, unescape
+from typing import List, Optional, Tuple
+
+# ================================================
+# Разметка Telegram HTML
+# ================================================
+# Теги, которые принимает Telegram при parse_mode=HTML
+TELEGRAM_TAGS = frozenset({
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "span", "tg-spoiler", "a", "code", "pre", "blockquote", "tg-emoji",
+})
+DIVIDER = "—————————"
+TELEGRAM_MESSAGE_LIMIT = 4096  # Лимит длины текста сообщения (в UTF-16 единицах, без тегов)
+
+# Один проход по уже экранированному тексту: блоки кода, SVG, заголовки, разделители и маркеры выделения
+# Переводы строк не токены: конец строки обрабатывается в тексте между токенами
+# Альтернативы сгруппированы по первому символу, чтобы на каждой позиции пробовать только подходящие
+_TOKEN_RE = re.compile(
+    r"(?=[`&#*~-])"  # Быстрый отсев позиций, с которых не начинается ни один токен
+    r"(?:\*(?:(?P<bold_italic>\*\*)"
+    # Простые пары без другой разметки внутри - один токен вместо двух маркеров
+    r"|\*(?P<bold_pair>[^\s*~`&][^*~`&\n]*?(?<=\S))\*\*(?!\*)"
+    r"|(?P<italic_pair>[^\s*~`&][^*~`&\n]*?(?<=\S))\*(?!\*)"
+    r"|(?P<bold>\*)"
+    # Одиночная * между пробелами (пункт списка, умножение) не может ни открыть, ни закрыть курсив
+    r"|(?P<italic>)(?:(?<=\S\*)|(?=\S)))"
+    r"|`(?:(?P<fence>``(?P<lang>[\w+#.-]*)[^\n`]*\n?(?P<fence_body>[\s\S]*?)(?:```|\Z))"
+    r"|(?P<code>[^`\n]+`))"
+    r"|(?P<heading>^\#{1,6}[ \t]+)"
+    r"|(?P<rule>^-{3,}[ \t]*$)"
+    r"|(?P<strike>~~)"
+    r"|(?P<svg>&lt;svg\b[\s\S]*?&lt;/svg&gt;))",
+    re.MULTILINE | re.IGNORECASE,
+)
+_INLINE_TAGS = {"bold": "b", "strike": "s", "italic": "i"}
+_PAIR_KINDS = {"bold_pair": ("bold", "**"), "italic_pair": ("italic", "*")}
+_HTML_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+# Неделимые части HTML при разбиении: теги, сущности, переводы строк, пробелы и слова
+_ATOM_RE = re.compile(r"<[^>]*>|&#?\w+;|\n|[ \t]+|[^<&\s]{1,256}|.", re.DOTALL)
+
+
+def _escape(text: str) -> str:
+    return escape(text, quote=False)
+
+
+class _Renderer:
+    # Состояние одного прохода: выходные фрагменты и стек открытых тегов текущей строки
+
+    def __init__(self, text: str):
+        self.text = text
+        self.out: List[str] = []
+        self.stack: List[Tuple[str, str, int]] = []  # (тег, исходный маркер, позиция открытия в out)
+        self.tags: List[str] = []  # Теги стека отдельно - для быстрой проверки, открыт ли тег
+        self.heading = False
+
+    def marker(self, kind: str, marker: str, start: int, end: int) -> None:
+        # Маркер выделения открывает или закрывает тег; непарный остается текстом
+        if kind == "bold" and self.heading:
+            return  # Заголовок и так жирный: **...** внутри него не нужен
+        tag = _INLINE_TAGS[kind]
+        text = self.text
+
+        if tag in self.tags and start and not text[start - 1].isspace():
+            depth = self.tags.index(tag)
+            # Вложенные незакрытые теги пересекаются с закрываемым - они остаются текстом
+            for inner in self.stack[depth + 1:]:
+                self.unwind(inner)
+            del self.stack[depth:]
+            del self.tags[depth:]
+            self.out.append(f"</{tag}>")
+        elif end < len(text) and not text[end].isspace():
+            self.stack.append((tag, marker, len(self.out)))
+            self.tags.append(tag)
+            self.out.append(f"<{tag}>")
+        else:
+            self.out.append(marker)
+
+    def pair(self, kind: str, marker: str, content: str, start: int, end: int) -> None:
+        # Пара маркеров вокруг текста без разметки: открытие и закрытие в одном шаге
+        tag = _INLINE_TAGS[kind]
+        if kind == "bold" and self.heading:
+            self.out.append(content)
+        elif tag not in self.tags:
+            self.out.append(f"<{tag}>{content}</{tag}>")
+        else:
+            # Такой тег уже открыт - маркеры разбираются по отдельности
+            self.marker(kind, marker, start, start + len(marker))
+            self.out.append(content)
+            self.marker(kind, marker, end - len(marker), end)
+
+    def bold_italic(self, start: int, end: int) -> None:
+        # *** - жирный курсив: два маркера в одной позиции, по умолчанию открываются как <b><i>
+        # Закрываются в порядке стека, чтобы теги оставались правильно вложенными
+        tags = self.tags
+        italic_first = "i" in tags and ("b" not in tags or tags.index("i") > tags.index("b"))
+        kinds = ("italic", "bold") if italic_first else ("bold", "italic")
+        for kind in kinds:
+            self.marker(kind, "*" * (2 if kind == "bold" else 1), start, end)
+
+    def unwind(self, entry: Tuple[str, str, int]) -> None:
+        # Открывающий тег без пары превращается обратно в исходный маркер
+        _, marker, index = entry
+        self.out[index] = marker
+
+    def end_line(self) -> None:
+        # Выделение не переносится через строку: незакрытые маркеры возвращаются в текст
+        for entry in self.stack:
+            self.unwind(entry)
+        self.stack.clear()
+        self.tags.clear()
+        if self.heading:
+            self.out.append("</u></b>")
+            self.heading = False
+
+    def block(self, html: str) -> None:
+        # Блоки кода не вкладываются в выделение
+        self.end_line()
+        self.out.append(html)
+
+    def line_break(self, start: int, end: int) -> None:
+        # Текст между токенами с переводом строки: на первом из них закрываются выделение и заголовок
+        newline = self.text.find("\n", start, end)
+        if newline == -1:
+            self.out.append(self.text[start:end])
+            return
+        self.out.append(self.text[start:newline])
+        self.end_line()
+        self.out.append(self.text[newline:end])
+
+    def render(self) -> str:
+        text = self.text
+        out = self.out
+        pos = 0
+        for match in _TOKEN_RE.finditer(text):
+            start, end = match.span()
+            if start > pos:
+                # Без открытого выделения текст между токенами добавляется как есть
+                if self.stack or self.heading:
+                    self.line_break(pos, start)
+                else:
+                    out.append(text[pos:start])
+            pos = end
+            kind = match.lastgroup
+
+            # Маркеры выделения - самые частые токены, проверяются первыми
+            if kind in _PAIR_KINDS:
+                self.pair(*_PAIR_KINDS[kind], match.group(kind), start, pos)
+            elif kind in _INLINE_TAGS:
+                self.marker(kind, match.group(0), start, pos)
+            elif kind == "bold_italic":
+                self.bold_italic(start, pos)
+            elif kind == "fence":
+                body = match.group("fence_body").rstrip("\n")
+                lang = match.group("lang")
+                if lang:
+                    self.block(f'<pre><code class="language-{lang}">{body}</code></pre>')
+                else:
+                    self.block(f"<pre>{body}</pre>")
+            elif kind == "svg":
+                self.block(f"<pre>{match.group(0)}</pre>")
+            elif kind == "code":
+                out.append(f"<code>{match.group(0)[1:-1]}</code>")
+            elif kind == "heading":
+                self.end_line()
+                out.append("<b><u>")
+                self.heading = True
+            elif kind == "rule":
+                self.end_line()
+                out.append(DIVIDER)
+
+        if pos < len(text):
+            self.line_break(pos, len(text))
+        self.end_line()
+        return "".join(out)
+
+
+def format_to_html(text: str) -> str:
+    """Преобразует markdown ответа модели в HTML, допустимый для Telegram"""
+    # Экранирование одним вызовом на весь текст: маркеры разметки его не затрагивают
+    return _Renderer(_escape(text)).render()
+
+
+def validate_telegram_html(html: str) -> Optional[str]:
+    """Возвращает описание первой ошибки разметки или None, если Telegram ее примет"""
+    stack: List[str] = []
+    for match in _HTML_TAG_RE.finditer(html):
+        closing, tag = match.group(1), match.group(2).lower()
+        if tag not in TELEGRAM_TAGS:
+            return f"unsupported tag <{tag}>"
+        if closing:
+            if not stack or stack[-1] != tag:
+                return f"unexpected </{tag}>"
+            stack.pop()
+            continue
+        # Внутри pre допускается только code, внутри code - ничего
+        if stack and (stack[-1] == "code" or (stack[-1] == "pre" and tag != "code")):
+            return f"<{tag}> inside <{stack[-1]}>"
+        stack.append(tag)
+    if stack:
+        return f"unclosed <{stack[-1]}>"
+    return None
+
+
+def _visible_length(atom: str) -> int:
+    # Длина атома так, как ее считает Telegram: теги не считаются, сущность - один символ
+    if atom.startswith("<"):
+        return 0
+    if atom.startswith("&") and len(atom) > 1:
+        return 1
+    return len(atom.encode("utf-16-le")) // 2
+
+
+def split_html(html: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Делит HTML на сообщения не длиннее limit, закрывая и заново открывая теги на границах"""
+    atoms = _ATOM_RE.findall(html)
+    chunks = []
+    stack: List[str] = []  # Открывающие теги, действующие в начале текущего сообщения
+    start = 0
+    while start < len(atoms):
+        parts = list(stack)
+        open_tags = list(stack)
+        length = 0
+        # Места разреза: (приоритет, длина до разреза, индекс атома, открытые теги)
+        breaks = []
+        end = start
+        while end < len(atoms):
+            atom = atoms[end]
+            size = _visible_length(atom)
+            if length + size > limit and length:
+                break
+            parts.append(atom)
+            length += size
+            end += 1
+            if atom.startswith("</"):
+                open_tags.pop()
+            elif atom.startswith("<"):
+                open_tags.append(atom)
+            elif atom == "\n" or atom[0] in " \t":
+                # Лучше всего резать между абзацами и вне блоков кода, хуже всего - по пробелу
+                in_pre = any(tag.startswith("<pre") for tag in open_tags)
+                paragraph = atom == "\n" and end >= 2 and atoms[end - 2] == "\n"
+                kind = (0 if in_pre else 3) + (2 if paragraph else 1 if atom == "\n" else 0)
+                breaks.append((kind, length, end, list(open_tags)))
+
+        if end < len(atoms):
+            # Разрез ищем во второй половине сообщения, чтобы не плодить короткие сообщения
+            late = [b for b in breaks if b[1] >= limit // 2] or breaks
+            if late:
+                _, _, end, open_tags = max(late, key=lambda b: (b[0], b[1]))
+                parts = parts[:len(stack) + end - start]
+
+        # Незакрытые теги закрываются в конце сообщения и открываются в начале следующего
+        parts.extend(f"</{_HTML_TAG_RE.match(tag).group(2)}>" for tag in reversed(open_tags))
+        chunk = "".join(parts)
+        if _HTML_TAG_RE.sub("", chunk).strip():
+            chunks.append(chunk)
+        stack = open_tags
+        start = end
+    return chunks
+
+
+def html_to_text(html: str) -> str:
+    """Убирает теги и сущности - для отправки без parse_mode"""
+    return unescape(_HTML_TAG_RE.sub("", html))
@@ -0,0 +1,68 @@
+import re
+import timeit
+from html import escape
+
+from bot.utils.formatting import format_to_html, validate_telegram_html
+
+# ================================================
+# Сравнение рендерера с прежним format_to_html на длинных ответах моделей
+# Запуск: python -m bot.utils.formatting_benchmark
+# ================================================
+SAMPLE_SECTION = """### **Раздел {n}**
+
+Вот **важный** момент и *курсив* с `inline_code({n})` внутри.
+Вложенное **жирное с *курсивом* внутри** и непарная звездочка 2 * 3.
+Пересекающиеся **маркеры *выделения** в* одной строке.
+А это ***жирный курсив*** и *курсив с **жирным концом***.
+
+```python
+def handler_{n}(items):
+    # <script> и & внутри кода экранируются
+    return [x * 2 for x in items if x > {n}]
+```
+
+---
+* пункт списка
+* еще один пункт с **выделением**
+"""
+SIZES = (10, 100, 1000)  # Количество разделов в ответе
+
+
+def legacy_format_to_html(text: str) -> str:
+    # Прежняя реализация из bot/handlers/base.py - только для сравнения
+    code_blocks = []
+
+    def preserve_code_blocks(match):
+        code_blocks.append(match.group(0))
+        return f"__CODE_BLOCK_{len(code_blocks)-1}__"
+
+    text = re.sub(r'```[\s\S]*?```', preserve_code_blocks, text)
+    text = re.sub(r'`[^`]+`', preserve_code_blocks, text)
+    text = re.sub(r'<svg[\s\S]*?</svg>', preserve_code_blocks, text, flags=re.IGNORECASE)
+    text = escape(text)
+    patterns = [
+        (r"### \*\*(.*?)\*\*", r"<b><u>\1</u></b>"),
+        (r"\*\*(.*?)\*\*", r"<b>\1</b>"),
+        (r"\*(.*?)\*", r"<i>\1</i>"),
+        (r"---", "—————————"),
+    ]
+    for pattern, replacement in patterns:
+        text = re.sub(pattern, replacement, text)
+    for i, code_block in enumerate(code_blocks):
+        text = text.replace(f"__CODE_BLOCK_{i}__", f"<pre>{escape(code_block)}</pre>")
+    return text
+
+
+def main() -> None:
+    for size in SIZES:
+        text = "".join(SAMPLE_SECTION.format(n=n) for n in range(size))
+        number = max(1, 1000 // size)
+        print(f"{size} разделов, {len(text)} символов:")
+        for name, render in (("legacy", legacy_format_to_html), ("renderer", format_to_html)):
+            seconds = min(timeit.repeat(lambda: render(text), number=number, repeat=7)) / number
+            error = validate_telegram_html(render(text))
+            print(f"  {name:<9} {seconds * 1000:9.2f} мс  разметка: {error or 'ok'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sys
+from collections import Counter
+from typing import Dict, List, Optional
+
+# ================================================
+# Локальный стенд вместо API провайдеров
+#
+# Поднимает HTTP-сервер, который отвечает как Anthropic Messages API и
+# OpenAI Chat Completions, и прогоняет через AIService серию запросов к обеим
+# моделям. Проверяет, что клиенты создаются, соединения переиспользуются
+# (keep-alive), и печатает системный промпт последнего запроса к Claude,
+# чтобы увидеть блоки с cache_control.
+#
+#   python -m bot.utils.provider_echo
+# ================================================
+REQUESTS_PER_MODEL = 20
+CONCURRENCY = 4
+
+
+class EchoServer:
+    """HTTP/1.1 сервер с keep-alive, запоминающий запросы и соединения"""
+
+    def __init__(self):
+        self.connections: Counter = Counter()  # Соединений по провайдеру
+        self.requests: Counter = Counter()  # Запросов по провайдеру
+        self.last_bodies: Dict[str, Dict] = {}
+        self.port = 0
+
+    async def start(self) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle_connection, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        return server
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        counted = set()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                provider = "anthropic" if path.startswith("/v1/messages") else "openai"
+                if provider not in counted:
+                    counted.add(provider)
+                    self.connections[provider] += 1
+                self.requests[provider] += 1
+                payload = json.loads(body) if body else {}
+                self.last_bodies[provider] = payload
+
+                response = json.dumps(self.make_response(provider, payload)).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(response)}\r\n\r\n".encode() + response
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def make_response(provider: str, payload: Dict) -> Dict:
+        # Минимальные ответы, которые принимают SDK
+        model = payload.get("model", "echo")
+        if provider == "anthropic":
+            return {
+                "id": "msg_echo", "type": "message", "role": "assistant", "model": model,
+                "content": [{"type": "text", "text": "echo"}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {
+                    "input_tokens": 1, "output_tokens": 1,
+                    "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+                },
+            }
+        return {
+            "id": "chatcmpl-echo", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "echo"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+
+def configure_environment(port: int) -> None:
+    # Настройки читаются при импорте config, поэтому задаются до импорта сервисов
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("ANTHROPIC_API_KEY", "echo")
+    os.environ.setdefault("OPENAI_API_KEY", "echo")
+    os.environ.setdefault("BOT_TOKEN", "echo")
+    os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1")
+    os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+
+async def run_requests(model: str, context: List[Dict[str, str]]) -> None:
+    from bot.services.ai_service import AIService
+    from bot.services.prompt_cache import SystemPrompt
+
+    service = AIService(model)
+    system_prompt = SystemPrompt("Static prompt " * 50, "Dynamic summary")
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(n: int) -> None:
+        async with semaphore:
+            await service.get_response(f"message {n}", context=context, system_prompt=system_prompt)
+
+    await asyncio.gather(*(send(n) for n in range(REQUESTS_PER_MODEL)))
+
+
+async def main() -> int:
+    echo = EchoServer()
+    server = await echo.start()
+    configure_environment(echo.port)
+
+    from bot.services.clients import provider_clients
+    from config import CLAUDE_MODEL, GPT_MODEL
+
+    context = [{"role": "user", "content": "earlier"}, {"role": "assistant", "content": "answer"}]
+    failed: Optional[str] = None
+    try:
+        await run_requests(CLAUDE_MODEL, context)
+        await run_requests(GPT_MODEL, context)
+    except Exception as e:
+        failed = f"{type(e).__name__}: {e}"
+    finally:
+        await provider_clients.close()
+        server.close()
+
+    for provider in ("anthropic", "openai"):
+        print(f"{provider}: {echo.requests[provider]} requests over {echo.connections[provider]} connections")
+    print("Claude system blocks:")
+    print(json.dumps(echo.last_bodies.get("anthropic", {}).get("system"), ensure_ascii=False, indent=2)[:1000])
+
+    # Соединений не больше, чем одновременных запросов - значит, keep-alive работает
+    for provider in ("anthropic", "openai"):
+        if echo.connections[provider] > CONCURRENCY:
+            failed = failed or f"{provider} opened {echo.connections[provider]} connections"
+        if echo.requests[provider] < REQUESTS_PER_MODEL:
+            failed = failed or f"{provider} served {echo.requests[provider]} of {REQUESTS_PER_MODEL} requests"
+    if failed:
+        print(f"FAILED: {failed}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+# ================================================
+# Нагрузочный стенд: сравнение webhook и polling на одной машине
+#
+# Стенд изображает Bot API: отдает записанные обновления через getUpdates
+# (polling) или отправляет их POST-запросами на webhook бота, а на все
+# исходящие методы бота отвечает заглушками. Бот запускается отдельно с
+# TELEGRAM_API_URL=http://127.0.0.1:<port> и нужным BOT_MODE.
+#
+#   python -m bot.utils.webhook_harness updates.jsonl --mode polling
+#   python -m bot.utils.webhook_harness updates.jsonl --mode webhook \
+#       --webhook-url http://127.0.0.1:8080/webhook --secret <WEBHOOK_SECRET>
+# ================================================
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Harness", "username": "harness_bot"}
+NO_RESULT_METHODS = ("sendChatAction", "setMyCommands", "setWebhook", "deleteWebhook", "deleteMessage")
+
+
+def load_updates(path: str, repeat: int) -> List[Dict]:
+    # Записанные обновления (по одному JSON на строку) с последовательными update_id
+    with open(path, encoding="utf-8") as file:
+        recorded = [json.loads(line) for line in file if line.strip()]
+    updates = []
+    for _ in range(repeat):
+        for update in recorded:
+            updates.append({**update, "update_id": len(updates) + 1})
+    return updates
+
+
+class Harness:
+    """Заглушка Bot API со счетчиками доставленных обновлений и ответов бота"""
+
+    def __init__(self, updates: List[Dict], idle_timeout: float):
+        self.updates = updates
+        self.idle_timeout = idle_timeout
+        self.delivered = 0
+        self.outbound = 0
+        self.message_id = 0
+        self.started: Optional[float] = None
+        self.last_activity = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+        if self.started is None:
+            self.started = self.last_activity
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(data)})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": FAKE_BOT_USER})
+
+        self.outbound += 1
+        self.touch()
+        if method in NO_RESULT_METHODS or not method.startswith(("send", "edit")):
+            return web.json_response({"ok": True, "result": True})
+        # Методы отправки и правки возвращают сообщение
+        self.message_id += 1
+        chat_id = int(data.get("chat_id") or 0)
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": FAKE_BOT_USER,
+            "text": data.get("text", ""),
+        }})
+
+    async def get_updates(self, data: Dict) -> List[Dict]:
+        offset = int(data.get("offset") or 0)
+        limit = int(data.get("limit") or 100)
+        self.delivered = max(self.delivered, offset - 1)
+        batch = self.updates[self.delivered:self.delivered + limit]
+        if batch:
+            self.touch()
+            return batch
+        # Обновлений больше нет - имитируем долгий опрос
+        await asyncio.sleep(min(float(data.get("timeout") or 0), 1.0))
+        return []
+
+    async def post_updates(self, url: str, secret: str, concurrency: int) -> None:
+        # Отправка обновлений на webhook бота с ограничением одновременных запросов
+        queue: asyncio.Queue = asyncio.Queue()
+        for update in self.updates:
+            queue.put_nowait(update)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+        async def worker(session: ClientSession) -> None:
+            while not queue.empty():
+                update = queue.get_nowait()
+                self.touch()
+                async with session.post(url, json=update, headers=headers) as response:
+                    if response.status != 200:
+                        print(f"update {update['update_id']}: HTTP {response.status}")
+                self.delivered += 1
+
+        async with ClientSession() as session:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+    async def wait_until_idle(self) -> None:
+        # Бот закончил работу, когда все обновления доставлены и он перестал отвечать
+        while self.delivered < len(self.updates) or time.monotonic() - self.last_activity < self.idle_timeout:
+            await asyncio.sleep(0.1)
+
+    def report(self) -> None:
+        elapsed = max(self.last_activity - (self.started or self.last_activity), 1e-9)
+        print(f"updates: {len(self.updates)}, outbound requests: {self.outbound}")
+        print(f"elapsed: {elapsed:.2f} s, throughput: {len(self.updates) / elapsed:.1f} updates/s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare webhook and polling throughput locally")
+    parser.add_argument("updates", help="JSON lines file with recorded Telegram updates")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="webhook")
+    parser.add_argument("--port", type=int, default=8081, help="port of the stand-in Bot API server")
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--concurrency", type=int, default=40, help="parallel webhook POSTs")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the recorded updates N times")
+    parser.add_argument("--idle-timeout", type=float, default=2.0)
+    parser.add_argument("--start-delay", type=float, default=5.0, help="seconds to wait for the bot to start")
+    args = parser.parse_args()
+
+    harness = Harness(load_updates(args.updates, args.repeat), args.idle_timeout)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", harness.handle_method)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    print(f"Bot API stand-in on http://127.0.0.1:{args.port}, mode: {args.mode}")
+
+    try:
+        if args.mode == "webhook":
+            await asyncio.sleep(args.start_delay)
+            await harness.post_updates(args.webhook_url, args.secret, args.concurrency)
+        await harness.wait_until_idle()
+        harness.report()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -15,16 +15,119 @@ YOUR_ADMIN_ID = 1483953251
 GPT_MODEL = env.str("GPT_MODEL", "gpt-5")
 CLAUDE_MODEL = env.str("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 MAX_TOKENS = env.int("MAX_TOKENS", 3500)
+# Размер окна контекста моделей (токены)
+MODEL_CONTEXT_WINDOWS = {
+    GPT_MODEL: env.int("GPT_CONTEXT_WINDOW", 400000),
+    CLAUDE_MODEL: env.int("CLAUDE_CONTEXT_WINDOW", 200000),
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+# Потоковые ответы: сообщение ожидания редактируется по мере генерации
+STREAM_RESPONSES = env.bool("STREAM_RESPONSES", True)
+STREAM_EDIT_INTERVAL = env.float("STREAM_EDIT_INTERVAL", 1.5)  # секунды между правками
+
+# Хеджирование: если основная модель медлит, тот же запрос уходит второй модели
+HEDGE_REQUESTS = env.bool("HEDGE_REQUESTS", False)
+HEDGE_MODELS = {GPT_MODEL: CLAUDE_MODEL, CLAUDE_MODEL: GPT_MODEL}  # основная -> запасная
+HEDGE_PERCENTILE = env.float("HEDGE_PERCENTILE", 95)  # перцентиль задержки основной модели
+HEDGE_MIN_DELAY = env.float("HEDGE_MIN_DELAY", 0.5)  # секунды
+HEDGE_DEFAULT_DELAY = env.float("HEDGE_DEFAULT_DELAY", 3.0)  # секунды, пока мало замеров
+HEDGE_MIN_SAMPLES = env.int("HEDGE_MIN_SAMPLES", 20)
+
+# Изображения пережимаются в JPEG под предельное разрешение провайдера
+IMAGE_JPEG_QUALITY = env.int("IMAGE_JPEG_QUALITY", 85)
+# Кэш результатов анализа изображений по file_unique_id (повторно пересланные фото)
+IMAGE_CACHE_SIZE = env.int("IMAGE_CACHE_SIZE", 2000)
+IMAGE_CACHE_TTL = env.int("IMAGE_CACHE_TTL", 86400)  # секунды
+
+# Кэш ответов на повторяющиеся запросы (одинаковые модель, промпт, контекст и текст)
+RESPONSE_CACHE_ENABLED = env.bool("RESPONSE_CACHE_ENABLED", False)
+RESPONSE_CACHE_BACKEND = env.str("RESPONSE_CACHE_BACKEND", "memory")  # memory или mongo
+RESPONSE_CACHE_SIZE = env.int("RESPONSE_CACHE_SIZE", 5000)
+RESPONSE_CACHE_TTL = env.int("RESPONSE_CACHE_TTL", 86400)  # секунды
 
 # API ключи
 OPENAI_API_KEY = env.str("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = env.str("ANTHROPIC_API_KEY", None)
+ANTHROPIC_BASE_URL = env.str("ANTHROPIC_BASE_URL", None)  # None - официальный API
+# Кэширование стабильной части системного промпта и истории на стороне Anthropic
+ANTHROPIC_PROMPT_CACHE = env.bool("ANTHROPIC_PROMPT_CACHE", True)
+
+# Пул HTTP-соединений к провайдерам ИИ (общий для всех моделей)
+PROVIDER_HTTP2 = env.bool("PROVIDER_HTTP2", True)
+PROVIDER_MAX_CONNECTIONS = env.int("PROVIDER_MAX_CONNECTIONS", 100)
+PROVIDER_MAX_KEEPALIVE = env.int("PROVIDER_MAX_KEEPALIVE", 20)
+PROVIDER_KEEPALIVE_EXPIRY = env.float("PROVIDER_KEEPALIVE_EXPIRY", 60.0)  # секунды
+PROVIDER_TIMEOUT = env.float("PROVIDER_TIMEOUT", 120.0)  # секунды
+
+# Контроль допуска запросов к моделям: одновременные запросы и очередь ожидания
+MODEL_MAX_IN_FLIGHT = {
+    GPT_MODEL: env.int("GPT_MAX_IN_FLIGHT", 20),
+    CLAUDE_MODEL: env.int("CLAUDE_MAX_IN_FLIGHT", 10),
+}
+DEFAULT_MAX_IN_FLIGHT = env.int("DEFAULT_MAX_IN_FLIGHT", 10)
+PROVIDER_MAX_QUEUE = env.int("PROVIDER_MAX_QUEUE", 50)  # запросов в очереди на модель
+PROVIDER_QUEUE_TIMEOUT = env.float("PROVIDER_QUEUE_TIMEOUT", 30.0)  # секунды, 0 - без ограничения
+
+# Повторы запросов к провайдерам и автомат отключения при сбоях
+PROVIDER_MAX_RETRIES = env.int("PROVIDER_MAX_RETRIES", 3)
+PROVIDER_RETRY_DEADLINE = env.float("PROVIDER_RETRY_DEADLINE", 60.0)  # секунды на все попытки
+PROVIDER_RETRY_BASE_DELAY = env.float("PROVIDER_RETRY_BASE_DELAY", 0.5)  # секунды
+PROVIDER_RETRY_MAX_DELAY = env.float("PROVIDER_RETRY_MAX_DELAY", 8.0)  # секунды
+CIRCUIT_FAILURE_THRESHOLD = env.int("CIRCUIT_FAILURE_THRESHOLD", 5)  # сбоев подряд до размыкания
+CIRCUIT_RECOVERY_TIMEOUT = env.float("CIRCUIT_RECOVERY_TIMEOUT", 30.0)  # секунды до пробного запроса
 
 # Бот и база данных
 BOT_TOKEN = env.str("BOT_TOKEN")
 MONGO_URL = env.str("MONGO_URL")
+# Режим получения обновлений: polling или webhook
+BOT_MODE = env.str("BOT_MODE", "polling")
+WEBHOOK_URL = env.str("WEBHOOK_URL", "")  # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = env.str("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = env.str("WEBHOOK_SECRET", "")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = env.str("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = env.int("WEBHOOK_PORT", 8080)
+WEBHOOK_MAX_CONNECTIONS = env.int("WEBHOOK_MAX_CONNECTIONS", 40)  # Одновременных соединений от Telegram
+UPDATE_CONCURRENCY = env.int("UPDATE_CONCURRENCY", 100)  # Обновлений в обработке одновременно
+# Адрес Bot API (локальный сервер или стенд для нагрузочного теста), пусто - api.telegram.org
+TELEGRAM_API_URL = env.str("TELEGRAM_API_URL", "")
+# Кэш пользователей в памяти процесса
+USER_CACHE_SIZE = env.int("USER_CACHE_SIZE", 10000)
+USER_CACHE_TTL = env.int("USER_CACHE_TTL", 60)  # секунды
+# Проверка планов запросов через explain() при старте (падает при COLLSCAN)
+DB_VERIFY_QUERY_PLANS = env.bool("DB_VERIFY_QUERY_PLANS", False)
 
 # Токены и тарифы
 FREE_TOKENS = 10
 DAILY_TOKENS = 10
+# Ленивое начисление: баланс обновляется при первом запросе за день вместо ночной задачи
+LAZY_DAILY_TOKENS = env.bool("LAZY_DAILY_TOKENS", False)
+DAILY_REWARDS_BATCH_SIZE = env.int("DAILY_REWARDS_BATCH_SIZE", 5000)  # 0 - один update_many на всех
 REFERRAL_TOKENS = 10
+
+# История диалогов
+HISTORY_FETCH_LIMIT = env.int("HISTORY_FETCH_LIMIT", 50)  # Сколько последних ходов читать из БД
+# Сводки длинных диалогов: ранние ходы сворачиваются в фоне
+# Каждая сводка - платный фоновый запрос, поэтому они включаются явно и по умолчанию идут в дешевую модель
+SUMMARIES_ENABLED = env.bool("SUMMARIES_ENABLED", False)
+SUMMARY_MODEL = env.str("SUMMARY_MODEL", "gpt-5-mini")
+SUMMARY_TRIGGER_TURNS = env.int("SUMMARY_TRIGGER_TURNS", 20)  # Несвернутых ходов до запуска сводки
+SUMMARY_KEEP_RECENT_TURNS = env.int("SUMMARY_KEEP_RECENT_TURNS", 10)  # Сколько последних ходов не сворачивать
+if not 0 <= SUMMARY_KEEP_RECENT_TURNS < SUMMARY_TRIGGER_TURNS:
+    raise ValueError("SUMMARY_KEEP_RECENT_TURNS must be >= 0 and less than SUMMARY_TRIGGER_TURNS")
+CONTEXT_TOKEN_BUDGET = env.int("CONTEXT_TOKEN_BUDGET", 6000)  # Максимум токенов истории в запросе
+HISTORY_MIGRATION_BATCH_SIZE = env.int("HISTORY_MIGRATION_BATCH_SIZE", 500)
+
+# Массовая рассылка (/send_all)
+BROADCAST_RATE_LIMIT = env.int("BROADCAST_RATE_LIMIT", 25)  # сообщений в секунду (лимит Telegram ~30)
+BROADCAST_WORKERS = env.int("BROADCAST_WORKERS", 20)
+BROADCAST_CHUNK_SIZE = env.int("BROADCAST_CHUNK_SIZE", 100)  # пользователей между контрольными точками (и максимум повторов при возобновлении)
+BROADCAST_REPORT_INTERVAL = env.int("BROADCAST_REPORT_INTERVAL", 10)  # секунды
+BROADCAST_MAX_RETRIES = 3
+
+# Исходящие запросы к Telegram: общий лимит, лимиты чатов и повторы после flood control
+TELEGRAM_GLOBAL_RATE = env.float("TELEGRAM_GLOBAL_RATE", 30.0)  # запросов в секунду на бота
+TELEGRAM_CHAT_RATE = env.float("TELEGRAM_CHAT_RATE", 1.0)  # сообщений в секунду в личный чат
+TELEGRAM_CHAT_BURST = env.int("TELEGRAM_CHAT_BURST", 3)  # сообщений подряд в личный чат без ожидания
+TELEGRAM_GROUP_RATE = env.int("TELEGRAM_GROUP_RATE", 20)  # сообщений в минуту в группу
+TELEGRAM_MAX_RETRIES = env.int("TELEGRAM_MAX_RETRIES", 3)
+TELEGRAM_CHAT_ACTION_TTL = env.float("TELEGRAM_CHAT_ACTION_TTL", 5.0)  # секунды, повторы действия склеиваются
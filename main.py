@@ -2,15 +2,27 @@ import asyncio
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from bot.database.database import Database
+from bot.database.migrations import ensure_unique_user_ids
 from bot.handlers import router
+from bot.services.broadcast import BroadcastService
+from bot.services.clients import provider_clients
+from bot.services.outbound import outbound_scheduler
+from bot.services.response_cache import create_response_backend, response_cache
+from bot.services.summarizer import ConversationSummarizer
+from bot.services.webhook import UpdateConcurrencyMiddleware, run_webhook
 from bot.utils.localization import get_text
 from bot.utils.daily_tokens import daily_rewards_task
 from bot.utils.logger import setup_logger
-from config import BOT_TOKEN, MONGO_URL
+from config import (
+    BOT_TOKEN, MONGO_URL, DB_VERIFY_QUERY_PLANS, LAZY_DAILY_TOKENS, RESPONSE_CACHE_ENABLED,
+    BOT_MODE, UPDATE_CONCURRENCY, TELEGRAM_API_URL
+)
 
 # ================================================
 # Логгер для главного модуля
@@ -48,18 +60,36 @@ async def setup_bot_commands(bot: Bot, language_code: str = "uk"):
         logger.error(f"Error registering commands: {e}")
 
 
+async def initialize_database(db: Database) -> None:
+    """Создание индексов и диагностика планов запросов"""
+    # Дубли пользователей от старых версий мешают построить уникальный индекс user_id
+    await ensure_unique_user_ids(db)
+    await db.create_indexes()
+    if DB_VERIFY_QUERY_PLANS:
+        await db.verify_query_plans()
+    if RESPONSE_CACHE_ENABLED:
+        response_cache.configure(create_response_backend(db))
+
+
 async def initialize_scheduler(bot: Bot, db: Database) -> AsyncIOScheduler:
     """Инициализация планировщика задач"""
     scheduler = AsyncIOScheduler(timezone="UTC")
-    scheduler.add_job(daily_rewards_task, "cron", hour=0, minute=0, args=(bot, db))
+    # В ленивом режиме токены начисляются при первом запросе за день
+    if not LAZY_DAILY_TOKENS:
+        scheduler.add_job(daily_rewards_task, "cron", hour=0, minute=0, args=(bot, db))
     scheduler.start()
     return scheduler
 
 
 async def initialize_bot_and_dispatcher() -> tuple[Bot, Dispatcher]:
     """Инициализация бота и диспетчера"""
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Другой адрес Bot API - для локального сервера Bot API или нагрузочного стенда
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Все отправки и правки сообщений проходят через общий планировщик
+    bot.session.middleware(outbound_scheduler)
     dp = Dispatcher()
+    dp.update.outer_middleware(UpdateConcurrencyMiddleware(UPDATE_CONCURRENCY))
     dp.include_router(router)
     return bot, dp
 
@@ -68,7 +98,8 @@ async def cleanup_resources(bot: Bot, db: Database):
     """Очистка ресурсов при завершении"""
     resources = [
         ("bot session", lambda: bot.session and bot.session.close()),
-        ("database connection", db.close)
+        ("database connection", db.close),
+        ("provider clients", provider_clients.close),
     ]
     
     for resource_name, cleanup_func in resources:
@@ -87,35 +118,47 @@ async def cleanup_resources(bot: Bot, db: Database):
     logger.info("Resources successfully cleaned up")
 
 
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    """Получение обновлений long polling"""
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        logger.info("Webhook successfully removed")
+    except Exception as e:
+        logger.warning(f"Error removing webhook: {e}")
+    logger.info("Bot started in polling mode")
+    await dp.start_polling(bot)
+
+
 async def main():
     """Главная функция запуска бота"""
     # ================================================
     # Инициализация компонентов
     # ================================================
     db = Database(MONGO_URL)
+    await initialize_database(db)
     bot, dp = await initialize_bot_and_dispatcher()
     scheduler = await initialize_scheduler(bot, db)
     
-    # Добавляем базу данных в контекст диспетчера
+    # Добавляем базу данных и фоновые сервисы в контекст диспетчера
     dp["db"] = db
+    dp["broadcasts"] = BroadcastService(db)
+    dp["summarizer"] = ConversationSummarizer(db)
 
     # ================================================
     # Настройка бота
     # ================================================
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Webhook successfully removed")
-    except Exception as e:
-        logger.warning(f"Error removing webhook: {e}")
-    
     await setup_bot_commands(bot)
-    logger.info("Bot started in polling mode")
+    # Открываем соединения с провайдерами ИИ до начала обработки сообщений
+    await provider_clients.warm_up()
     
     # ================================================
     # Запуск бота
     # ================================================
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     finally: